@@ -1,19 +1,224 @@
 import os
 import re
 
+try:
+    from collections import OrderedDict
+except ImportError:  # Python < 2.7
+    from django.utils.datastructures import SortedDict as OrderedDict
+
 # Test classes inherit from the Django TestCase
 from django.test import TestCase
 
 # If you're wanting to do direct database queries you'll need this
 from django.db import connection
+from django.db.models.manager import Manager
+from django.db.models.query import EmptyQuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
+
+# Django versions prior to 1.2 don't have multi-database support
+try:
+    from django.db import connections
+except ImportError:
+    connections = None
 
 # The BeautifulSoup HTML parser is useful for testing markup fragments
 from BeautifulSoup import BeautifulSoup as Soup
 
 # needed to login to the admin
 from django.contrib.auth.models import User
+from django.conf import settings
 from django.utils.encoding import smart_str
 
+class LRUCache(object):
+    """
+    A bounded cache which forgets the least recently used entry when it's
+    full. hits and misses count the lookups since it was last cleared.
+    """
+
+    def __init__(self, size=500):
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key, create, *args):
+        "Returns the entry for key, calling create(*args) to make it if there isn't one"
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            value = create(*args)
+            if len(self.entries) >= self.size:
+                del self.entries[iter(self.entries).next()]
+        else:
+            self.hits += 1
+        # The most recently used entries are kept at the end
+        self.entries[key] = value
+        return value
+
+    def stats(self):
+        "Returns a dictionary of the hits, misses and number of cached entries"
+        return {'hits': self.hits, 'misses': self.misses,
+            'size': len(self.entries), 'maxsize': self.size}
+
+class PatternCache(LRUCache):
+    """
+    The compiled regular expressions shared by the assertions. The re
+    module's own cache is emptied completely whenever it fills up, so
+    suites using a lot of patterns end up compiling them over and over.
+    """
+
+    def compile(self, pattern, flags=0):
+        "Returns the compiled pattern, compiling it if it isn't cached"
+        return self.lookup((type(pattern), pattern, flags), re.compile,
+            pattern, flags)
+
+regex_cache = PatternCache(getattr(settings, 'TEST_REGEX_CACHE_SIZE', 500))
+
+def get_queryset(model):
+    "Returns all the objects of a model or manager, or a queryset as it is"
+    if hasattr(model, 'query'):
+        return model
+    if isinstance(model, Manager):
+        return model.all()
+    return model.objects.all()
+
+# SQLite allows at most 500 selects in a compound select, and 999 parameters
+MAX_UNION = 50
+
+def count_objects(models):
+    """
+    Returns the number of objects in each of a list of models or
+    querysets, counting them all with one query per database, a UNION
+    ALL of a count of each.
+    """
+    querysets = [get_queryset(model) for model in models]
+    if connections is None:
+        return [queryset.count() for queryset in querysets]
+
+    counts = [0] * len(querysets)
+    by_database = {}
+    for index, queryset in enumerate(querysets):
+        if isinstance(queryset, EmptyQuerySet):
+            continue
+        query = queryset.query.clone()
+        # The order doesn't change how many there are, even of a slice,
+        # and related columns could clash in the subquery
+        query.clear_ordering(True)
+        query.select_related = False
+        try:
+            sql, params = query.get_compiler(queryset.db).as_sql()
+        except EmptyResultSet:
+            continue
+        by_database.setdefault(queryset.db, []).append((index, sql, params))
+
+    for db, subqueries in by_database.items():
+        cursor = connections[db].cursor()
+        for start in range(0, len(subqueries), MAX_UNION):
+            selects = []
+            params = []
+            for index, sql, subquery_params in subqueries[start:start + MAX_UNION]:
+                selects.append('SELECT %d, COUNT(*) FROM (%s) count_%d' % (index, sql, index))
+                params.extend(subquery_params)
+            cursor.execute(' UNION ALL '.join(selects), params)
+            for index, count in cursor.fetchall():
+                counts[index] = count
+    return counts
+
+def get_diagnostic_window():
+    "The number of characters of context shown either side of a match"
+    return getattr(settings, 'TEST_DIAGNOSTIC_WINDOW', 200)
+
+def excerpt(text, start, end, window=None):
+    """
+    Returns text from start to end with up to window characters either
+    side, marking where it was cut with ...
+    """
+    if window is None:
+        window = get_diagnostic_window()
+    begin = max(0, start - window)
+    finish = min(len(text), end + window)
+    return (begin and '...' or '') + text[begin:finish] + \
+        (finish < len(text) and '...' or '')
+
+def closest_match(needle, haystack):
+    """
+    Returns the position and length of the longest start of needle found
+    in haystack, or None if not even its first character is.
+    """
+    # Any start of the needle which is found has all its shorter ones found
+    low, high = 0, len(needle)
+    position = -1
+    while low < high:
+        middle = (low + high + 1) // 2
+        found = haystack.find(needle[:middle])
+        if found >= 0:
+            low, position = middle, found
+        else:
+            high = middle - 1
+    if not low:
+        return None
+    return position, low
+
+def diagnose_missing(needle, haystack, subject='Content'):
+    "Describes how haystack fails to contain needle, showing where it comes closest"
+    if not (isinstance(needle, basestring) and isinstance(haystack, basestring)):
+        return "%s should contain `%s' but doesn't:\n%s" % (subject, needle, haystack)
+    match = closest_match(needle, haystack)
+    if match is None:
+        return "%s should contain `%s' but doesn't:\n%s" % (subject, needle,
+            excerpt(haystack, 0, 0))
+    position, length = match
+    return "%s should contain `%s' but doesn't, the closest is `%s':\n%s" % (
+        subject, needle, needle[:length],
+        excerpt(haystack, position, position + length))
+
+def diagnose_present(needle, haystack, subject='Content'):
+    "Describes where haystack contains needle"
+    if not (isinstance(needle, basestring) and isinstance(haystack, basestring)):
+        return "%s should not contain `%s' but does:\n%s" % (subject, needle, haystack)
+    position = haystack.find(needle)
+    return "%s should not contain `%s' but does:\n%s" % (subject, needle,
+        excerpt(haystack, position, position + len(needle)))
+
+def _xpath(xpath):
+    from lxml import etree
+    return etree.XPath(xpath)
+
+def _css_selector(selector):
+    from lxml.cssselect import CSSSelector
+    return CSSSelector(selector)
+
+# Compiled XPath expressions and CSS selectors, shared by all the tests in
+# the run. CSS selectors need cssselect
+xpath_cache = LRUCache(getattr(settings, 'TEST_XPATH_CACHE_SIZE', 500))
+selector_cache = LRUCache(getattr(settings, 'TEST_XPATH_CACHE_SIZE', 500))
+
+def compile_xpath(xpath):
+    "Returns the compiled lxml XPath for an expression, only compiling it once"
+    return xpath_cache.lookup(xpath, _xpath, xpath)
+
+# CSS selectors never start like this, relative XPaths should start with ./
+_xpath_start = re.compile(r'/|\./|\.\.|\(|@|[\w-]+\(')
+
+def is_xpath(selector):
+    "Tells XPath expressions from CSS selectors"
+    return bool(_xpath_start.match(selector)) or '::' in selector
+
+def compile_selector(selector):
+    "Returns the compiled lxml XPath for an XPath expression or a CSS selector"
+    if is_xpath(selector):
+        return compile_xpath(selector)
+    return selector_cache.lookup(selector, _css_selector, selector)
+
+def node_text(node):
+    "Returns the text of a node, or of an attribute or text() match, without surrounding whitespace"
+    if isinstance(node, basestring):
+        return node.strip()
+    return ''.join(node.itertext()).strip()
 
 class Common(TestCase):
     """
@@ -39,6 +244,11 @@ class Common(TestCase):
         """
         pass
 
+    def _post_teardown(self):
+        # Don't keep the documents parsed by this test once it's finished
+        self._trees = {}
+        super(Common, self)._post_teardown()
+
     # A few useful helpers methods
 
     def execute_sql(*sql):
@@ -47,6 +257,10 @@ class Common(TestCase):
         cursor.execute(*sql)
         return cursor
 
+    def count_objects(self, models):
+        "Returns the number of objects in each of a list of models or querysets, in one query"
+        return count_objects(models)
+
     # Custom assertions
 
     def assert_equal(self, *args, **kwargs):
@@ -58,46 +272,59 @@ class Common(TestCase):
         "Assert that two values are not equal"
         return not self.assertNotEqual(*args, **kwargs)
 
+    # The diagnostics are only worked out on failure, as the haystack may
+    # be a whole response
+
     def assert_contains(self, needle, haystack, diagnostic=''):
         'Assert that one value (the hasystack) contains another value (the needle)'
-        diagnostic = diagnostic + "\nContent should contain `%s' but doesn't:\n%s" % (needle, haystack)
-        diagnostic = diagnostic.strip()
-        return self.assert_(needle in haystack, diagnostic)
+        if needle not in haystack:
+            diagnostic = diagnostic + "\n" + diagnose_missing(needle, haystack)
+            self.fail(diagnostic.strip())
 
     def assert_doesnt_contain(self, needle, haystack):  #  CONSIDER  deprecate me for deny_contains
         "Assert that one value (the hasystack) does not contain another value (the needle)"
-        return self.assert_(needle not in haystack, "Content should not contain `%s' but does:\n%s" % (needle, haystack))
+        if needle in haystack:
+            self.fail(diagnose_present(needle, haystack))
 
     def deny_contains(self, needle, haystack):
         "Assert that one value (the hasystack) does not contain another value (the needle)"
-        return self.assert_(needle not in haystack, "Content should not contain `%s' but does:\n%s" % (needle, haystack))
+        if needle in haystack:
+            self.fail(diagnose_present(needle, haystack))
 
     def assert_regex_contains(self, pattern, string, flags=None):
         'Assert that the given regular expression matches the string'
         flags = flags or 0
-        disposition = re.search(pattern, string, flags)
-        self.assertTrue(disposition != None, repr(smart_str(pattern)) + ' should match ' + repr(smart_str(string)))
+        disposition = regex_cache.compile(pattern, flags).search(string)
+        if disposition is None:
+            self.fail(repr(smart_str(pattern)) + ' should match ' + repr(smart_str(string)))
 
     def deny_regex_contains(self, pattern, slug):
         'Deny that the given regular expression pattern matches a string'
 
-        r = re.compile(pattern)
+        r = regex_cache.compile(pattern)
+        slug = smart_str(slug)
 
         self.assertEqual( None,
-                          r.search(smart_str(slug)),
-                          pattern + ' should not match ' + smart_str(slug) )
+                          r.search(slug),
+                          pattern + ' should not match ' + slug )
 
     def assert_count(self, expected, model):
-        "Assert that their are the expected number of instances of a given model"
-        actual = model.objects.count()
-        self.assert_equal(expected, actual, "%s should have %d objects, had %d" % (model.__name__, expected, actual))
+        "Assert that their are the expected number of instances of a given model, or in a queryset"
+        queryset = get_queryset(model)
+        actual = queryset.count()
+        self.assert_equal(expected, actual, "%s should have %d objects, had %d" % (queryset.model.__name__, expected, actual))
 
     def assert_counts(self, expected_counts, models):
-        "Assert than a list of numbers is equal to the number of instances of a list of models"
+        """
+        Assert than a list of numbers is equal to the number of instances of a
+        list of models or querysets, counting them in one query. Returns the
+        counts.
+        """
         if len(expected_counts) != len(models):
-            raise("Number of counts and number of models should be equal")
-        actual_counts = [model.objects.count() for model in models]
-        self.assert_equal(expected_counts, actual_counts, "%s should have counts %s but had %s" % ([m.__name__ for m in models], expected_counts, actual_counts))
+            raise ValueError("Number of counts and number of models should be equal")
+        actual_counts = count_objects(models)
+        self.assert_equal(list(expected_counts), actual_counts, "%s should have counts %s but had %s" % ([get_queryset(m).model.__name__ for m in models], expected_counts, actual_counts))
+        return actual_counts
 
     def assert_is_instance(self, model, obj):
         "Assert than a given object is an instance of a model"
@@ -135,13 +362,29 @@ class Common(TestCase):
             assert(False)
 
     def _xml_to_tree(self, xml, forgiving=False):
-        from lxml import etree
+        """
+        Parses a document, remembering the tree for the rest of the test so
+        checking the same document again doesn't parse it again. Trees are
+        passed through as they are.
+        """
         self._xml = xml
 
         if not isinstance(xml, basestring):
             self._xml = str(xml)  #  TODO  tostring
             return xml
 
+        # Python remembers the hash of a string, so looking the same
+        # response up again doesn't hash it again
+        trees = self.__dict__.setdefault('_trees', {})
+        key = (xml, forgiving)
+        tree = trees.get(key)
+        if tree is None:
+            tree = trees[key] = self._parse_xml(xml, forgiving)
+        return tree
+
+    def _parse_xml(self, xml, forgiving=False):
+        from lxml import etree
+
         if '<html' in xml[:200]:
             parser = etree.HTMLParser(recover=forgiving)
             return etree.HTML(str(xml), parser)
@@ -152,13 +395,67 @@ class Common(TestCase):
     def assert_xml(self, xml, xpath, **kw):
         'Check that a given extent of XML or HTML contains a given XPath, and return its first node'
         tree = self._xml_to_tree(xml, forgiving=kw.get('forgiving', False))
-        nodes = tree.xpath(xpath)
-        self.assertTrue(len(nodes) > 0, xpath + ' should match ' + self._xml)
+        nodes = compile_xpath(xpath)(tree)
+        if not nodes:
+            self.fail(xpath + ' should match ' + self._xml)
         node = nodes[0]
         if kw.get('verbose', False):
             self.reveal_xml(node)
         return node
 
+    def assert_xpaths(self, xml, xpaths, **kw):
+        """
+        Check that a given extent of XML or HTML contains every one of a list
+        of XPaths, parsing it once, and return the first node of each. All
+        the XPaths which don't match are reported together.
+        """
+        tree = self._xml_to_tree(xml, forgiving=kw.get('forgiving', False))
+        nodes = []
+        missing = []
+        for xpath in xpaths:
+            found = compile_xpath(xpath)(tree)
+            if found:
+                nodes.append(found[0])
+                if kw.get('verbose', False):
+                    self.reveal_xml(found[0])
+            else:
+                missing.append(xpath)
+        if missing:
+            self.fail(', '.join(missing) + ' should match ' + self._xml)
+        return nodes
+
+    def assert_structure(self, xml, expected, **kw):
+        """
+        Check a given extent of XML or HTML against a dictionary of XPath
+        expressions or CSS selectors, parsing it once. The expected values
+        can be the number of nodes which should match, the text the first
+        match should have, True for at least one match or False for none.
+        XPaths which return a value, like count(//a), are compared with it
+        directly. Every mismatch is reported together, and the matches for
+        each selector are returned.
+        """
+        tree = self._xml_to_tree(xml, forgiving=kw.get('forgiving', False))
+        found = {}
+        mismatches = []
+        for selector in sorted(expected.keys()):
+            value = expected[selector]
+            nodes = found[selector] = compile_selector(selector)(tree)
+            if not isinstance(nodes, list):
+                actual = nodes
+            elif isinstance(value, bool):
+                actual = len(nodes) > 0
+            elif isinstance(value, basestring):
+                actual = None
+                if nodes:
+                    actual = node_text(nodes[0])
+            else:
+                actual = len(nodes)
+            if actual != value:
+                mismatches.append("%s should be %r, is %r" % (selector, value, actual))
+        if mismatches:
+            self.fail('\n'.join(mismatches) + '\nin ' + self._xml)
+        return found
+
     def reveal_xml(self, node):
         'Spews an XML node as source, for diagnosis'
         from lxml import etree
@@ -167,5 +464,13 @@ class Common(TestCase):
     def deny_xml(self, xml, xpath):
         'Check that a given extent of XML or HTML does not contain a given XPath'
         tree = self._xml_to_tree(xml)
-        nodes = tree.xpath(xpath)
-        self.assertEqual(0, len(nodes), xpath + ' should not appear in ' + self._xml)
\ No newline at end of file
+        nodes = compile_xpath(xpath)(tree)
+        if nodes:
+            self.fail(xpath + ' should not appear in ' + self._xml)
+
+    def deny_xpaths(self, xml, xpaths):
+        'Check that a given extent of XML or HTML contains none of a list of XPaths, parsing it once'
+        tree = self._xml_to_tree(xml)
+        found = [xpath for xpath in xpaths if compile_xpath(xpath)(tree)]
+        if found:
+            self.fail(', '.join(found) + ' should not appear in ' + self._xml)
@@ -1,6 +1,5 @@
 # Test classes inherit from the Django TestCase
-from common import Common
-import re
+from common import Common, regex_cache, diagnose_missing, diagnose_present
 
 # needed to login to the admin
 from django.contrib.auth.models import User
@@ -61,15 +60,17 @@ class DjangoCommon(Common):
 
     def assert_response_contains(self, fragment, response):
         "Assert that a response object contains a given string"
-        self.assert_(fragment in response.content, "Response should contain `%s' but doesn't:\n%s" % (fragment, response.content))
+        if fragment not in response.content:
+            self.fail(diagnose_missing(fragment, response.content, 'Response'))
 
     def assert_response_doesnt_contain(self, fragment, response):
         "Assert that a response object does not contain a given string"
-        self.assert_(fragment not in response.content, "Response should not contain `%s' but does:\n%s" % (fragment, response.content))
+        if fragment in response.content:
+            self.fail(diagnose_present(fragment, response.content, 'Response'))
 
     def assert_render_matches(self, template, match_regexp, vars={}):
         "Assert than the output from rendering a given template with a given context matches a given regex"
-        r = re.compile(match_regexp)
+        r = regex_cache.compile(match_regexp)
         actual = Template(template).render(Context(vars))
         self.assert_(r.match(actual), "Expected: %s\nGot: %s" % (
             match_regexp, actual
@@ -97,7 +98,7 @@ class DjangoCommon(Common):
         self.assert_equal(expected, self.render(template, **kwargs))
 
     def assert_render_matches(self, match_regexp, template, vars={}):
-        r = re.compile(match_regexp)
+        r = regex_cache.compile(match_regexp)
         actual = Template(template).render(Context(vars))
         self.assert_(r.match(actual), "Expected: %s\nGot: %s" % (
             match_regexp, actual
@@ -100,6 +100,23 @@ class Examples(Common):
         self.assert_response_contains('<h1>', response)
         self.assert_response_doesnt_contain("Not on page", response)
 
+    def test_page_structure(self):
+        "Example of checking the structure of a page with XPath, the page is only parsed once"
+        response = self.client.get('/example/')
+        self.assert_xml(response.content, '//h1')
+        self.assert_xpaths(response.content, ['//title', '//form[@method="post"]', '//table//tr'])
+        self.deny_xpaths(response.content, ['//div[@class="error"]', '//blink'])
+
+    def test_page_structure_counts(self):
+        "Example of checking a page against XPaths and CSS selectors in one go, reporting every mismatch"
+        response = self.client.get('/example/')
+        self.assert_structure(response.content, {
+            '//title': 'Page Title',
+            'ul.results > li': 10,
+            '//form[@method="post"]': True,
+            'div.error': False,
+        })
+
     def test_using_beautiful_soup(self):
         "Example test for content on a given view, this time using the BeautifulSoup parser"
         response = self.client.get('/example/')
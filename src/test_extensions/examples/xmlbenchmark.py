@@ -0,0 +1,80 @@
+"""
+Micro-benchmark for the xml test result, comparing how long it takes to
+record and write out a run where every test fails with the way failures
+used to be serialized, a line at a time.
+
+    python xmlbenchmark.py [tests] [frames]
+"""
+
+import sys
+import time
+import traceback
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from test_extensions.testrunners.xmloutput import _XmlTextTestResult
+
+try:
+    # The django.utils.unittest alias is available in Django >= 1.3
+    from django.utils import unittest
+except ImportError:
+    import unittest
+
+class NullStream(object):
+    def write(self, string):
+        pass
+
+class LegacyResult(_XmlTextTestResult):
+    "Serializes failures the way the result did before"
+
+    def addFailure(self, test, err):
+        unittest.TestResult.addFailure(self, test, err)
+        self._lastWas = 'failure'
+        errorsAndFailures = '<failure type="%s">' % err[0].__name__
+        for line in apply(traceback.format_exception, err):
+           for l in line.split("\n")[:-1]:
+              errorsAndFailures += escape(l)
+        errorsAndFailures += "</failure>"
+        self._errorsAndFailures = [errorsAndFailures]
+
+class Failing(unittest.TestCase):
+    frames = 20
+
+    def recurse(self, depth):
+        if depth:
+            return self.recurse(depth - 1)
+        self.fail('<expected> & "actual" differ\x1b[0m\n' * 20)
+
+    def test_fail(self):
+        self.recurse(self.frames)
+
+def make_failure(frames):
+    "Returns a failing test and the failure it raised"
+    Failing.frames = frames
+    test = Failing('test_fail')
+    try:
+        test.test_fail()
+    except AssertionError:
+        return test, sys.exc_info()
+
+def time_result(result_class, test, err, count):
+    result = result_class(NullStream(), 1, 1)
+    start = time.time()
+    for i in range(count):
+        result.startTest(test)
+        result.addFailure(test, err)
+        result.stopTest(test)
+    return time.time() - start
+
+def main(count=2000, frames=20):
+    test, err = make_failure(frames)
+    print '%d failures, %d frames deep' % (count, frames)
+    for name, result_class in (('before', LegacyResult),
+            ('after', _XmlTextTestResult)):
+        print '%-8s %.3fs' % (name, time_result(result_class, test, err, count))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,26 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--xmlcoverage', action='store_true', dest='xmlcoverage',
+            default=False,
+            help='Write the combined coverage report into a xml file too'),
+        make_option('--coverage_html_only', action='store_true', dest='coverage_html_only',
+            default=False,
+            help='Supress stdout output if using HTML output. Else, is ignored'),
+    )
+    help = """Combines the coverage data files written by several shards
+        or machines, e.g. .coverage.shard1of4, into .coverage and reports
+        on the given apps, or on every installed app."""
+    args = '[appname ...]'
+
+    def handle(self, *test_labels, **options):
+        from test_extensions.testrunners.codecoverage import combine_coverage, \
+            get_coverage_modules_for_labels, report_coverage
+
+        cov = combine_coverage()
+        report_coverage(cov, get_coverage_modules_for_labels(test_labels),
+            xml_out=options.get('xmlcoverage', False),
+            html_only=options.get('coverage_html_only', False))
@@ -0,0 +1,46 @@
+import glob
+import os
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from test_extensions.testrunners.xmloutput import DEFAULT_XML_OUTPUT
+from test_extensions.testrunners.xmlmerge import merge_reports
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--output', '-o', action='store', dest='output',
+            default=None,
+            help='File to write the merged report to. Defaults to the '
+                 'TEST_XML_OUTPUT setting or temp/xml/test_output.xml'),
+        make_option('--name', action='store', dest='name', default='',
+            help='Name for the merged test suite'),
+    )
+    help = """Merges the xml reports from several shards or worker
+        processes into one. With no reports given, merges those written
+        next to the output file, e.g. temp/xml/test_output_*.xml."""
+    args = '[report ...]'
+
+    requires_model_validation = False
+
+    def handle(self, *reports, **options):
+        output = options.get('output') or getattr(settings,
+            'TEST_XML_OUTPUT', DEFAULT_XML_OUTPUT)
+        if not reports:
+            root, ext = os.path.splitext(output)
+            reports = sorted(glob.glob('%s_*%s' % (root, ext)))
+        if not reports:
+            raise CommandError('No reports to merge')
+
+        output_path = os.path.abspath(output)
+        for report in reports:
+            if not os.path.exists(report):
+                raise CommandError("Report '%s' does not exist" % report)
+            if os.path.abspath(report) == output_path:
+                raise CommandError("Can't merge '%s' into itself" % report)
+
+        merge_reports(reports, output, options.get('name', ''))
+        if int(options.get('verbosity', 1)) > 0:
+            print 'Merged %d report%s into %s' % (len(reports),
+                len(reports) != 1 and 's' or '', output)
@@ -1,9 +1,13 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import autoreload
+from optparse import make_option
 import os
 import sys
 import time
 
+from test_extensions.reloading import ModuleReloader, RestartNeeded, module_file
+from test_extensions.watcher import get_watch_dirs, get_watcher, PollingWatcher
+
 INPROGRESS_FILE = 'testing.inprogress'
 
 def get_test_command():
@@ -36,18 +40,26 @@ def my_reloader_thread():
     # the user is prompted to delete the database.  Instead, wait for
     # INPROGRESS_FILE to disappear, then exit.  Exiting the thread will then
     # rerun the suite.
+    watcher = get_watcher()
     while autoreload.RUN_RELOADER:
-        if autoreload.code_changed():
+        if watcher.wait(1):
             while os.path.exists(INPROGRESS_FILE):
-                time.sleep(1)
+                time.sleep(0.1)
             sys.exit(3) # force reload
-        time.sleep(1)
 
 # monkeypatch the reloader_thread function with the one above
 autoreload.reloader_thread = my_reloader_thread
 
 class Command(BaseCommand):
-    option_list = BaseCommand.option_list
+    option_list = BaseCommand.option_list + (
+        make_option('--changed', action='store_true', dest='changed',
+            default=False,
+            help='Only run the tests affected by each change'),
+        make_option('--warm', action='store_true', dest='warm',
+            default=False,
+            help='Keep the test database and reload changed modules in '
+                 'place rather than restarting'),
+    )
     help = "Starts a command that tests upon saving files."
     args = '[optional apps to test]'
 
@@ -55,6 +67,9 @@ class Command(BaseCommand):
     requires_model_validation = False
 
     def handle(self, *args, **options):
+        if options.get('warm'):
+            return self.handle_warm(*args, **options)
+
         if os.path.exists(INPROGRESS_FILE):
             os.remove(INPROGRESS_FILE)
 
@@ -69,3 +84,62 @@ class Command(BaseCommand):
                     os.remove(INPROGRESS_FILE)
 
         autoreload.main(inner_run)
+
+    def handle_warm(self, *args, **options):
+        """
+        Runs the affected tests in this process after each change, keeping
+        the test database between runs.
+        """
+        try:
+            from test_extensions.testrunners.impact import \
+                ImpactTestSuiteRunner, get_changed_labels
+            import coverage
+        except ImportError:
+            raise CommandError('--warm needs Django 1.3 or later and coverage')
+
+        verbosity = int(options.get('verbosity', 1))
+        runner = ImpactTestSuiteRunner(verbosity, False, False)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        reloader = ModuleReloader(PollingWatcher(get_watch_dirs()).is_watched)
+        watcher = get_watcher()
+        restart = False
+        # The files of the modules reloaded since the last run
+        reloaded = set()
+        try:
+            run = True
+            while not restart:
+                if run:
+                    # Tests importing a reloaded module run again even if
+                    # none of the lines they ran has changed
+                    test_labels = get_changed_labels(list(args), reloaded)
+                    reloaded = set()
+                    if test_labels:
+                        runner.run_suite(runner.build_suite(test_labels))
+                    else:
+                        print 'No tests affected by the change'
+                changed = watcher.wait(1)
+                if not changed:
+                    run = False
+                    continue
+                try:
+                    names = reloader.reload(changed)
+                    if verbosity >= 2:
+                        print 'Reloaded %s' % ', '.join(names)
+                    reloaded.update([module_file(sys.modules[name]) for name in names])
+                    run = True
+                except RestartNeeded, e:
+                    print '%s, restarting' % e
+                    restart = True
+                except Exception:
+                    # Leave the tests until the problem is fixed
+                    import traceback
+                    traceback.print_exc()
+                    run = False
+        except KeyboardInterrupt:
+            pass
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+        if restart:
+            os.execv(sys.executable, [sys.executable] + sys.argv)
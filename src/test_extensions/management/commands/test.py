@@ -1,19 +1,20 @@
 import sys
+import signal
 from optparse import make_option
 
 from django.core import management
 from django.conf import settings
-from django.db.models import get_app, get_apps
-from django.core.management.base import BaseCommand
-
-# Django versions prior to 1.2 don't include the DjangoTestSuiteRunner class;
-# Django versions since 1.2 include multi-database support, which doesn't play
-# nicely with the database setup in the XML test runner.
-try:
-    from django.test.simple import DjangoTestSuiteRunner
-    xml_runner = 'test_extensions.testrunners.xmloutput.XMLTestSuiteRunner'
-except ImportError:  # We are in a version prior to 1.2
-    xml_runner = 'test_extensions.testrunners.xmloutput.run_tests'
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs put together from any of these options, see testrunners.pipeline
+pipeline_runner = 'test_extensions.testrunners.pipeline.run_tests'
+pipeline_options = ('nodb', 'coverage', 'xmlcoverage', 'figleaf', 'xml', 'parallel',
+    'failed_first')
+
+# Plain runs with Django's own runner are put together the same way, so
+# they record the test timings too
+django_runners = ('django.test.simple.DjangoTestSuiteRunner',
+    'django.test.simple.run_tests')
 
 skippers = []
 
@@ -31,9 +32,20 @@ class Command(BaseCommand):
         make_option('--noinput', action='store_false', dest='interactive',
             default=True,
             help='Tells Django to NOT prompt the user for input of any kind.'),
-        make_option('--callgraph', action='store_true', dest='callgraph',
+        make_option('--profile', action='store_true', dest='profile',
+            default=False,
+            help='Profile the tests by sampling, writing collapsed stacks for '
+                 'flame graphs next to the coverage HTML report or in temp'),
+        make_option('--callgraph', action='store_true', dest='profile',
+            help='Deprecated, the same as --profile'),
+        make_option('--profile-tests', action='store_true', dest='profile_tests',
             default=False,
-            help='Generate execution call graph (slow!)'),
+            help='Profile each test with cProfile, saving the profiles to '
+                 'temp/profiles and reporting the hotspots. Needs --xml'),
+        make_option('--profile-threshold', action='store', dest='profile_threshold',
+            type='float', default=None,
+            help='Only keep the profiles of tests taking at least this many '
+                 'seconds. Implies --profile-tests'),
         make_option('--coverage', action='store_true', dest='coverage',
             default=False,
             help='Show coverage details'),
@@ -48,26 +60,66 @@ class Command(BaseCommand):
             help='Produce figleaf coverage report'),
         make_option('--xml', action='store_true', dest='xml', default=False,
             help='Produce JUnit-type xml output'),
+        make_option('--xml-output', action='store', dest='xml_output',
+            default=None,
+            help='File to write the xml output to. Defaults to the '
+                 'TEST_XML_OUTPUT setting or temp/xml/test_output.xml'),
         make_option('--nodb', action='store_true', dest='nodb', default=False,
             help='No database required for these tests'),
         make_option('--failfast', action='store_true', dest='failfast',
             default=False,
             help='Tells Django to stop running the test suite after first failed test.'),
-
+        make_option('--parallel', action='store', dest='parallel', type='int',
+            default=0,
+            help='Run the tests in N worker processes, each with its own test database'),
+        make_option('--shard', action='store', dest='shard', default=None,
+            help='Only run shard K of N of the tests, given as K/N'),
+        make_option('--shard-timings', action='store', dest='shard_timings',
+            default=None,
+            help='Balance the shards using the test timings in this file, which '
+                 'every shard must be given. Defaults to the TEST_SHARD_TIMINGS '
+                 'setting'),
+        make_option('--failed-first', action='store_true', dest='failed_first',
+            default=False,
+            help='Run the tests that failed last time first'),
+        make_option('--slowest', action='store', dest='slowest', type='int',
+            default=0,
+            help='Print the N slowest tests from the recorded test timings'),
+        make_option('--record-impact', action='store_true', dest='record_impact',
+            default=False,
+            help='Record the source lines each test runs, for use by --changed'),
+        make_option('--changed', action='store_true', dest='changed',
+            default=False,
+            help='Only run the tests affected by source changes since the last run'),
+        make_option('--list', action='store_true', dest='list_tests',
+            default=False,
+            help='Print the ids of the tests instead of running them'),
     )
     help = """Custom test command which allows for
         specifying different test runners."""
     args = '[appname ...]'
 
-    requires_model_validation = True
+    # Validating the models imports every app, which runs without the
+    # database can do without, so handle validates the others itself
+    requires_model_validation = False
 
     def handle(self, *test_labels, **options):
+        if not options.get('nodb'):
+            self.validate()
 
         verbosity = int(options.get('verbosity', 1))
         interactive = options.get('interactive', True)
-        callgraph = options.get('callgraph', False)
+        profile = options.get('profile', False)
+        profile_threshold = options.get('profile_threshold')
+        profile_tests = options.get('profile_tests', False) or \
+            profile_threshold is not None
         failfast = options.get("failfast", False)
         coverage_html_only = options.get("coverage_html_only", False)
+        parallel = options.get('parallel', 0)
+        failed_first = options.get('failed_first', False)
+        slowest = options.get('slowest', 0)
+        changed = options.get('changed', False)
+        record_impact = changed or options.get('record_impact', False)
 
         # it's quite possible someone, lets say South, might have stolen
         # the syncdb command from django. For testing purposes we should
@@ -76,24 +128,26 @@ class Command(BaseCommand):
         management.get_commands()
         management._commands['syncdb'] = 'django.core'
 
-        if options.get('nodb'):
-            if options.get('xmlcoverage'):
-                test_runner_name = 'test_extensions.testrunners.nodatabase.run_tests_with_xmlcoverage'
-            elif options.get('coverage'):
-                test_runner_name = 'test_extensions.testrunners.nodatabase.run_tests_with_coverage'
-            else:
-                test_runner_name = 'test_extensions.testrunners.nodatabase.run_tests'
-        elif options.get('xmlcoverage'):
-            test_runner_name = 'test_extensions.testrunners.codecoverage.run_tests_xml'
-        elif options.get ('coverage'):
-            test_runner_name = 'test_extensions.testrunners.codecoverage.run_tests'
-        elif options.get('figleaf'):
-            test_runner_name = 'test_extensions.testrunners.figleafcoverage.run_tests'
-        elif options.get('xml'):
-            test_runner_name = xml_runner
+        if record_impact:
+            for option in ('parallel', 'xml', 'coverage', 'xmlcoverage', 'figleaf'):
+                if options.get(option):
+                    raise CommandError('--%s cannot be combined with --changed '
+                        'or --record-impact' % option)
+            test_runner_name = 'test_extensions.testrunners.impact.ImpactTestSuiteRunner'
+        elif [option for option in pipeline_options if options.get(option)] or \
+                settings.TEST_RUNNER in django_runners:
+            if parallel:
+                for option in ('figleaf', 'profile', 'profile_tests'):
+                    if options.get(option):
+                        raise CommandError('--%s cannot be combined with '
+                            '--parallel' % option.replace('_', '-'))
+            test_runner_name = pipeline_runner
         else:
             test_runner_name = settings.TEST_RUNNER
 
+        if profile_tests and not options.get('xml'):
+            raise CommandError('--profile-tests needs --xml')
+
         test_path = test_runner_name.split('.')
         # Allow for Python 2.5 relative paths
         if len(test_path) > 1:
@@ -103,30 +157,116 @@ class Command(BaseCommand):
         test_module = __import__(test_module_name, {}, {}, test_path[-1])
         test_runner = getattr(test_module, test_path[-1])
 
+        # Name the apps to test, so sharding, listing and --changed leave
+        # out the same ones as the runners
+        if not test_labels and (options.get('nodb') or hasattr(settings, 'SKIP_TESTS')):
+            from test_extensions.testrunners.pipeline import get_test_apps
+            test_labels = list()
+            for app in get_test_apps(options.get('nodb', False)):
+                test_labels.append(app.__name__.split('.')[-2])
+
         if hasattr(settings, 'SKIP_TESTS'):
-            if not test_labels:
-                test_labels = list()
-                for app in get_apps():
-                    test_labels.append(app.__name__.split('.')[-2])
             for app in settings.SKIP_TESTS:
                 try:
                     test_labels = list(test_labels)
                     test_labels.remove(app)
                 except ValueError:
                     pass
+
+        shard = options.get('shard')
+        if shard:
+            from test_extensions.testrunners.sharding import parse_shard, \
+                get_shard_labels, shard_suffix, shard_file_name
+            timings_file = options.get('shard_timings') or \
+                getattr(settings, 'TEST_SHARD_TIMINGS', None)
+            try:
+                shard, shards = parse_shard(shard)
+                test_labels = get_shard_labels(test_labels, shard, shards,
+                    timings_file)
+            except ValueError, e:
+                raise CommandError(e)
+            if not test_labels:
+                print 'No tests to run in shard %d/%d' % (shard, shards)
+                return
+
+        if changed:
+            from test_extensions.testrunners.impact import get_changed_labels
+            test_labels = get_changed_labels(test_labels)
+            if not test_labels:
+                print 'No tests affected by changes since the last run'
+                return
+
+        if options.get('list_tests'):
+            from test_extensions.testrunners.discovery import list_tests
+            try:
+                test_ids = list_tests(test_labels)
+            except ValueError, e:
+                raise CommandError(e)
+            for test_id in test_ids:
+                print test_id
+            return
                     
         test_options = dict(verbosity=verbosity,
             interactive=interactive)
             
-        if options.get('coverage'):
-            test_options["callgraph"] = callgraph
-            test_options["html_only"] = coverage_html_only
+        if test_runner_name == pipeline_runner:
+            test_options.update(processes=parallel,
+                failfast=failfast,
+                nodatabase=options.get('nodb', False),
+                xml_out=options.get('xml', False),
+                coverage=options.get('coverage', False),
+                xmlcoverage=options.get('xmlcoverage', False),
+                html_only=coverage_html_only,
+                figleaf=options.get('figleaf', False),
+                failed_first=failed_first)
+            if profile_tests:
+                test_options["profile_tests"] = profile_threshold or 0.0
+            if parallel or options.get('xml'):
+                from test_extensions.testrunners.xmloutput import DEFAULT_XML_OUTPUT
+                test_options["xml_output"] = options.get('xml_output') or \
+                    getattr(settings, 'TEST_XML_OUTPUT', DEFAULT_XML_OUTPUT)
+
+            # Each shard writes its own artifacts so they can be combined later,
+            # and leaves the timings alone so the split can't change under it
+            if shard:
+                test_options["record_timings"] = False
+                if "xml_output" in test_options:
+                    test_options["xml_output"] = shard_file_name(
+                        test_options["xml_output"], shard, shards)
+                if options.get('coverage') or options.get('xmlcoverage'):
+                    test_options["data_suffix"] = shard_suffix(shard, shards)
+        elif record_impact:
+            test_options["nodatabase"] = options.get('nodb', False)
         
+        if profile:
+            from test_extensions.testrunners.profiling import SamplingProfiler, \
+                DEFAULT_INTERVAL, report_profile
+            if not hasattr(signal, 'setitimer'):
+                raise CommandError('--profile needs signal.setitimer, which is '
+                    'only available on Unix with Python 2.6 or later')
+            profiler = SamplingProfiler(getattr(settings,
+                'TEST_PROFILE_INTERVAL', DEFAULT_INTERVAL))
+            profiler.start()
+
         try:
-            failures = test_runner(test_labels, **test_options)
-        except TypeError: #Django 1.2
-            test_options["failfast"] = failfast
-            failures = test_runner(**test_options).run_tests(test_labels)
-        
+            if isinstance(test_runner, type): #Django 1.2
+                test_options["failfast"] = failfast
+                failures = test_runner(**test_options).run_tests(test_labels)
+            else:
+                failures = test_runner(test_labels, **test_options)
+        finally:
+            if profile:
+                profiler.stop()
+
+        if profile:
+            report_profile(profiler)
+
+        if slowest:
+            from test_extensions.testrunners.timings import slowest_tests
+            print
+            print 'Slowest tests:'
+            for seconds, test_id in slowest_tests(slowest):
+                print '%8.3fs %s' % (seconds, test_id)
+
         if failures:
             sys.exit(failures)
@@ -0,0 +1,141 @@
+"""
+Reloads changed project modules in place, for the warm mode of runtester.
+
+Along with each changed module, the project modules which import from it
+are reloaded too, dependencies first, so that they pick up the new classes
+and functions. Models and settings can't be reloaded in place, as models
+are registered with Django and the test database is built from them, so
+a change to one of those means starting the process again.
+"""
+
+import os
+import sys
+import types
+
+class RestartNeeded(Exception):
+    "Raised when a change can't be picked up without a fresh process"
+
+def module_file(module):
+    "Returns the absolute path of a module's source file, if it has one"
+    filename = getattr(module, '__file__', None)
+    if not filename:
+        return None
+    if filename.endswith('.pyc') or filename.endswith('.pyo'):
+        filename = filename[:-1]
+    return os.path.abspath(filename)
+
+def needs_restart(name):
+    "Whether changes to the named module need a new process"
+    settings_module = os.environ.get('DJANGO_SETTINGS_MODULE', 'settings')
+    return name == settings_module or 'models' in name.split('.')
+
+def module_dependencies(module, names):
+    """
+    Returns the modules among names which the module imports from. Values
+    such as constants don't know their module, so the import statements
+    in the module's source are looked at too.
+    """
+    from test_extensions.testrunners.discovery import imported_names
+    dependencies = set()
+    filename = module_file(module)
+    if filename and os.path.exists(filename):
+        if os.path.basename(filename).startswith('__init__.'):
+            package = module.__name__
+        else:
+            package = module.__name__.rpartition('.')[0]
+        source = open(filename)
+        try:
+            try:
+                dependencies.update(imported_names(source.read(), package) & set(names))
+            except SyntaxError:
+                pass
+        finally:
+            source.close()
+        dependencies.discard(module.__name__)
+    for value in vars(module).values():
+        if isinstance(value, types.ModuleType):
+            name = value.__name__
+            if name.startswith(module.__name__ + '.'):
+                # A package's own submodules aren't imported from
+                continue
+        else:
+            name = getattr(value, '__module__', None)
+        if name in names and name != module.__name__:
+            dependencies.add(name)
+    return dependencies
+
+class ModuleReloader(object):
+    """
+    Reloads the modules for changed source files, for which is_watched
+    returns True, and their dependents.
+    """
+
+    def __init__(self, is_watched):
+        self.is_watched = is_watched
+
+    def project_modules(self):
+        "Returns a map of module name to module for the loaded project modules"
+        modules = {}
+        for name, module in sys.modules.items():
+            filename = module_file(module)
+            if filename and self.is_watched(filename):
+                modules[name] = module
+        return modules
+
+    def reload_order(self, filenames):
+        """
+        Returns the names of the modules to reload for the changed files,
+        with each one after the modules it imports from.
+        """
+        modules = self.project_modules()
+        changed = set([name for name, module in modules.items()
+            if module_file(module) in filenames])
+        for filename in filenames:
+            if not os.path.exists(filename):
+                raise RestartNeeded('%s has been removed' % filename)
+
+        graph = dict([(name, module_dependencies(module, modules))
+            for name, module in modules.items()])
+        dependents = set(changed)
+        while True:
+            found = set([name for name, dependencies in graph.items()
+                if name not in dependents and dependencies & dependents])
+            if not found:
+                break
+            dependents.update(found)
+
+        for name in dependents:
+            if needs_restart(name):
+                raise RestartNeeded('%s has changed' % name)
+
+        ordered, seen = [], set()
+        def visit(name):
+            if name in seen:
+                return
+            seen.add(name)
+            for dependency in sorted(graph[name] & dependents):
+                visit(dependency)
+            ordered.append(name)
+        for name in sorted(dependents):
+            visit(name)
+        return ordered
+
+    def reload(self, filenames):
+        "Reloads the modules for the changed files, returning their names"
+        names = self.reload_order([os.path.abspath(f) for f in filenames])
+        for name in names:
+            module = sys.modules[name]
+            # A .pyc written in the same second as the change looks up to
+            # date, so make sure the source is compiled again
+            for ext in ('c', 'o'):
+                compiled = module_file(module) + ext
+                if os.path.exists(compiled):
+                    os.remove(compiled)
+            reload(module)
+
+        try:
+            from django.core.urlresolvers import clear_url_caches
+            clear_url_caches()
+        except ImportError:  # Django < 1.1
+            pass
+        return names
@@ -1,51 +1,143 @@
 import coverage
-import os, sys
+import os, re, sys
+import fnmatch
 from inspect import getmembers, ismodule
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 from django.conf import settings
-from django.test.simple import run_tests as django_test_runner
 from django.db.models import get_app, get_apps
-from django.utils.functional import curry
-
-from nodatabase import run_tests as nodatabase_run_tests
-
-def is_wanted_module(mod):
-    included = getattr(settings, "COVERAGE_INCLUDE_MODULES", [])
-    excluded = getattr(settings, "COVERAGE_EXCLUDE_MODULES", [])
-    
-    marked_to_include = None 
-
-    for exclude in excluded:
-        if exclude.endswith("*"):
-            if mod.__name__.startswith(exclude[:-1]):
-                marked_to_include = False
-        elif mod.__name__ == exclude:
-            marked_to_include = False
-    
-    for include in included:
-        if include.endswith("*"):
-            if mod.__name__.startswith(include[:-1]):
-                marked_to_include = True
-        elif mod.__name__ == include:
-            marked_to_include = True
-    
-    # marked_to_include=None handles not user-defined states
-    if marked_to_include is None:
-        if included and excluded:
-            # User defined exactly what they want, so exclude other
-            marked_to_include = False
-        elif excluded:
-            # User could define what the want not, so include other.
-            marked_to_include = True
-        elif included:
-            # User enforced what they want, so exclude other
-            marked_to_include = False
-        else:
-            # Usar said nothing, so include anything
-            marked_to_include = True
-
-    return marked_to_include
-    
+
+from pipeline import Stage, make_run, find_app
+from htmlcoverage import get_html_directory, html_report
+
+def _compile_globs(patterns):
+    "Compiles glob patterns into one regular expression, or None"
+    if not patterns:
+        return None
+    expressions = [fnmatch.translate(pattern).replace('(?ms)', '')
+        for pattern in patterns]
+    return re.compile('|'.join(['(?:%s)' % e for e in expressions]), re.S)
+
+def _is_glob(pattern):
+    return '*' in pattern or '?' in pattern or '[' in pattern
+
+def _leading_parts(value, separator):
+    "Returns the leading parts of value, a.b.c giving a and a.b"
+    parts = []
+    index = value.find(separator)
+    while index != -1:
+        parts.append(value[:index])
+        index = value.find(separator, index + 1)
+    return parts
+
+def _normalize_path(path):
+    path = os.path.normpath(path)
+    if os.path.isabs(path):
+        path = os.path.relpath(path)
+    return path.replace(os.sep, '/')
+
+class ModuleRules(object):
+    """
+    A set of patterns matched against module names, or against file paths
+    relative to the current directory for patterns containing a slash.
+    Patterns are shell style globs. Those without wildcards, and those of
+    the form package.* or directory/*, are looked up directly, so the time
+    they take depends on how deep the module is rather than how many
+    patterns there are. Any other globs are combined into one regular
+    expression.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.names, self.name_prefixes, name_globs = set(), set(), []
+        self.paths, self.path_prefixes, path_globs = set(), set(), []
+        for pattern in self.patterns:
+            if '/' in pattern:
+                pattern = _normalize_path(pattern)
+                exact, prefixes, globs, separator = \
+                    self.paths, self.path_prefixes, path_globs, '/'
+            else:
+                exact, prefixes, globs, separator = \
+                    self.names, self.name_prefixes, name_globs, '.'
+            if not _is_glob(pattern):
+                exact.add(pattern)
+            elif pattern.endswith(separator + '*') and not _is_glob(pattern[:-2]):
+                prefixes.add(pattern[:-2])
+            else:
+                globs.append(pattern)
+        self.name_globs = _compile_globs(name_globs)
+        self.path_globs = _compile_globs(path_globs)
+
+    def __nonzero__(self):
+        return bool(self.patterns)
+
+    def _matches(self, value, exact, prefixes, globs, separator):
+        if value in exact:
+            return True
+        if prefixes:
+            for part in _leading_parts(value, separator):
+                if part in prefixes:
+                    return True
+        return globs is not None and globs.match(value) is not None
+
+    def matches(self, name, path=None):
+        if self._matches(name, self.names, self.name_prefixes,
+                self.name_globs, '.'):
+            return True
+        if path is not None and (self.paths or self.path_prefixes or self.path_globs):
+            return self._matches(_normalize_path(path), self.paths,
+                self.path_prefixes, self.path_globs, '/')
+        return False
+
+class ModuleMatcher(object):
+    """
+    Decides which modules to report coverage on from the include and
+    exclude patterns. A module matching an include pattern is always
+    reported on, even if it matches an exclude pattern too, and one
+    matching only an exclude pattern never is. Modules matching neither
+    are only reported on if there are no include patterns.
+    """
+
+    def __init__(self, included=(), excluded=()):
+        self.included = ModuleRules(included)
+        self.excluded = ModuleRules(excluded)
+
+    def is_wanted(self, name, path=None):
+        if self.included and self.included.matches(name, path):
+            return True
+        if self.excluded and self.excluded.matches(name, path):
+            return False
+        # User enforced what they want, so exclude other; otherwise
+        # include anything not excluded
+        return not self.included
+
+_matcher = (None, None)
+
+def get_module_matcher():
+    """
+    Returns the matcher for the COVERAGE_INCLUDE_MODULES and
+    COVERAGE_EXCLUDE_MODULES settings, only compiled again if they change.
+    """
+    global _matcher
+    key = (tuple(getattr(settings, "COVERAGE_INCLUDE_MODULES", [])),
+        tuple(getattr(settings, "COVERAGE_EXCLUDE_MODULES", [])))
+    if _matcher[0] != key:
+        _matcher = (key, ModuleMatcher(*key))
+    return _matcher[1]
+
+def is_wanted_module(mod, path=None):
+    """
+    Whether to report coverage on a module, given the module or its name
+    and optionally its file.
+    """
+    name = getattr(mod, '__name__', mod)
+    if path is None:
+        path = getattr(mod, '__file__', None)
+    return get_module_matcher().is_wanted(name, path)
 
 def get_coverage_modules(app_module):
     """
@@ -58,123 +150,167 @@ def get_coverage_modules(app_module):
     return [coverage_module] + [attr for name, attr in
         getmembers(coverage_module) if ismodule(attr) and name != 'tests']
 
-def get_all_coverage_modules(app_module):
+DEFAULT_MODULES_CACHE = 'temp/coverage_modules.pickle'
+
+def get_modules_cache_file():
+    return getattr(settings, 'COVERAGE_MODULES_CACHE', DEFAULT_MODULES_CACHE)
+
+def load_listings(file_name=None):
+    "Returns the directory listings saved by the last run, if any"
+    file_name = file_name or get_modules_cache_file()
+    try:
+        cache_file = open(file_name, 'rb')
+    except IOError:
+        return {}
+    try:
+        try:
+            return pickle.load(cache_file)
+        except Exception:
+            # A cache from another version, or half written; start again
+            return {}
+    finally:
+        cache_file.close()
+
+def save_listings(listings, file_name=None):
+    file_name = file_name or get_modules_cache_file()
+    directory = os.path.dirname(file_name)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp_name = '%s.%d' % (file_name, os.getpid())
+    cache_file = open(temp_name, 'wb')
+    try:
+        pickle.dump(listings, cache_file, pickle.HIGHEST_PROTOCOL)
+    finally:
+        cache_file.close()
+    os.rename(temp_name, file_name)
+
+def list_directory(path, listings):
+    """
+    Returns the python files and the subdirectories in a directory. The
+    listing is kept in listings and reused for as long as the directory's
+    modification time stays the same.
+    """
+    mtime = os.stat(path).st_mtime
+    listing = listings.get(path)
+    if listing is None or listing[0] != mtime:
+        files, dirs = [], []
+        for name in sorted(os.listdir(path)):
+            if name.lower().endswith('.py'):
+                files.append(name)
+            elif os.path.isdir(os.path.join(path, name)):
+                dirs.append(name)
+        listing = listings[path] = (mtime, files, dirs)
+    return listing[1], listing[2]
+
+def find_package_modules(package_name, package_dir, listings):
+    """
+    Returns a (module name, file name) pair for every python file in a
+    package and its subpackages, found from the file system alone.
+    """
+    modules = []
+    packages = [(package_name, package_dir)]
+    while packages:
+        name, path = packages.pop(0)
+        files, dirs = list_directory(path, listings)
+        for file_name in files:
+            module_name = file_name[:-3].lower()
+            if module_name == '__init__':
+                module_name = name
+            else:
+                module_name = '%s.%s' % (name, module_name)
+            modules.append((module_name, os.path.join(path, file_name)))
+        for dir_name in dirs:
+            dir_path = os.path.join(path, dir_name)
+            if '__init__.py' in list_directory(dir_path, listings)[0]:
+                packages.append(('%s.%s' % (name, dir_name), dir_path))
+    return modules
+
+def get_all_coverage_modules(app_module, listings=None):
     """
-    Returns all possible modules to report coverage on, even if they
-    aren't loaded.
+    Returns the files of all the modules to report coverage on for an
+    application, whether or not they have been loaded. Nothing is
+    imported: modules are found from the application's directory and
+    filtered by name.
     """
-    # We start off with the imported models.py, so we need to import
-    # the parent app package to find the path.
+    # We start off with the imported models.py, whose package has to have
+    # been imported already, and whose path gives the app's directory.
     app_path = app_module.__name__.split('.')[:-1]
-    app_package = __import__('.'.join(app_path), {}, {}, app_path[-1])
+    if app_path[0] in getattr(settings, 'EXCLUDE_FROM_COVERAGE', []):
+        return []
+    app_package = sys.modules['.'.join(app_path)]
     app_dirpath = app_package.__path__[-1]
 
-    mod_list = []
-    for root, dirs, files in os.walk(app_dirpath):
-        root_path = app_path + root[len(app_dirpath):].split(os.path.sep)[1:]
-        excludes = getattr(settings, 'EXCLUDE_FROM_COVERAGE', [])
-        if app_path[0] not in excludes:
-            for file in files:
-                if file.lower().endswith('.py'):
-                    mod_name = file[:-3].lower()
-                    try:
-                        mod = __import__('.'.join(root_path + [mod_name]),
-                            {}, {}, mod_name)
-                    except ImportError:
-                        pass
-                    else:
-                        mod_list.append(mod)
-
-    return mod_list
+    if listings is None:
+        listings = {}
+    matcher = get_module_matcher()
+    return [file_name for name, file_name in
+        find_package_modules('.'.join(app_path), app_dirpath, listings)
+        if matcher.is_wanted(name, file_name)]
 
-def run_tests(test_labels, verbosity=1, interactive=True,
-        extra_tests=[], nodatabase=False, xml_out=False, callgraph=False, html_only=False):
+def get_coverage_modules_for_labels(test_labels, lightweight=False):
     """
-    Test runner which displays a code coverage report at the end of the
-    run.
+    Returns the modules to report coverage on for the given test labels,
+    or for every installed app if no labels are given. If lightweight is
+    set only the apps named in the labels are imported.
     """
-    cov = coverage.coverage()
-    cov.erase()
-    cov.use_cache(0)
-
-    test_labels = test_labels or getattr(settings, "TEST_APPS", None)
-    cover_branch = getattr(settings, "COVERAGE_BRANCH_COVERAGE", False)
-    cov = coverage.coverage(branch=cover_branch, cover_pylib=False)
-    cov.use_cache(0)
-     
-    coverage_modules = []
     if test_labels:
-        for label in test_labels:
-            # Don't report coverage if you're only running a single
-            # test case.
-            if '.' not in label:
-                app = get_app(label)
-                coverage_modules.extend(get_all_coverage_modules(app))
+        # Don't report coverage if you're only running a single
+        # test case.
+        find = lightweight and find_app or get_app
+        apps = [find(label) for label in test_labels if '.' not in label]
     else:
-        for app in get_apps():
-            coverage_modules.extend(get_all_coverage_modules(app))
+        apps = get_apps()
 
-    morfs = filter(is_wanted_module, coverage_modules)
+    listings = load_listings()
+    saved = dict(listings)
+    coverage_modules = []
+    for app in apps:
+        coverage_modules.extend(get_all_coverage_modules(app, listings))
+    if listings != saved:
+        save_listings(listings)
+    return coverage_modules
 
-    if callgraph:
-        try:
-            import pycallgraph
-            #_include = [i.__name__ for i in coverage_modules]
-            _included = getattr(settings, "COVERAGE_INCLUDE_MODULES", [])
-            _excluded = getattr(settings, "COVERAGE_EXCLUDE_MODULES", [])
-
-            _included = [i.strip('*')+'*' for i in _included]
-            _excluded = [i.strip('*')+'*' for i in _included]
-
-            _filter_func = pycallgraph.GlobbingFilter(
-                include=_included or ['*'],
-                #include=['lotericas.*'],
-                #exclude=[],
-                #max_depth=options.max_depth,
-            )
-
-            pycallgraph_enabled = True
-        except ImportError:
-            pycallgraph_enabled = False
-    else:
-        pycallgraph_enabled = False
+DEFAULT_DATA_FILE = '.coverage'
 
-    cov.start()
-    
-    if pycallgraph_enabled:
-        pycallgraph.start_trace(filter_func=_filter_func)
+def make_coverage(data_file=None, data_suffix=None):
+    """
+    Returns a coverage collector using the coverage settings. With a
+    data_suffix of True every process saves its data to a file of its own
+    next to data_file, for combine_coverage to put together.
+    """
+    cover_branch = getattr(settings, "COVERAGE_BRANCH_COVERAGE", False)
+    return coverage.coverage(data_file=data_file, data_suffix=data_suffix,
+        branch=cover_branch, cover_pylib=False)
 
-    if nodatabase:
-        results = nodatabase_run_tests(test_labels, verbosity, interactive,
-            extra_tests)
-    else:
-        results = django_test_runner(test_labels, verbosity, interactive,
-            extra_tests)
-    
-    if callgraph and pycallgraph_enabled:
-        pycallgraph.stop_trace()
-
-    cov.stop()
-    
-    if getattr(settings, "COVERAGE_HTML_REPORT", False) or \
-            os.environ.get("COVERAGE_HTML_REPORT"):
-        output_dir = getattr(settings, "COVERAGE_HTML_DIRECTORY", "covhtml")
-        report_method = curry(cov.html_report, directory=output_dir)
-        if callgraph and pycallgraph_enabled:
-            callgraph_path = output_dir + '/' + 'callgraph.png'
-            pycallgraph.make_dot_graph(callgraph_path)
-
-        print >>sys.stdout
-        print >>sys.stdout, "Coverage HTML reports were output to '%s'" %output_dir
-        if callgraph:
-            if pycallgraph_enabled:
-                print >>sys.stdout, "Call graph was output to '%s'" %callgraph_path
-            else:
-                print >>sys.stdout, "Call graph was not generated: Install 'pycallgraph' module to do so"
+def get_run_data_file():
+    """
+    Returns the prefix for the data files of this run's processes. It is
+    particular to the run so that only its own files get combined, and
+    doesn't start with .coverage. so the files are left alone by anyone
+    combining those.
+    """
+    return '%s_%d' % (DEFAULT_DATA_FILE, os.getpid())
 
-    else:
-        report_method = cov.report
+def combine_coverage(data_file=DEFAULT_DATA_FILE, data_suffix=None):
+    """
+    Combines the data files saved by each process next to data_file,
+    removing them, and returns a collector with the combined data to
+    report on. The combined data is saved to .coverage, and to
+    .coverage.<data_suffix> as well if given.
+    """
+    cov = make_coverage(data_file)
+    cov.combine()
+    cov.data.write_file(DEFAULT_DATA_FILE)
+    if data_suffix:
+        cov.data.write_file('%s.%s' % (DEFAULT_DATA_FILE, data_suffix))
+    return cov
 
+def report_coverage(cov, coverage_modules, xml_out=False, html_only=False):
+    """
+    Writes the text and, optionally, the xml and HTML coverage reports for
+    the given modules. With html_only the text report is left out when
+    there is an HTML one.
+    """
     if coverage_modules:
         if xml_out:
             # using the same output directory as the --xml function uses for testing
@@ -183,13 +319,72 @@ def run_tests(test_labels, verbosity=1, interactive=True,
             output_filename = 'temp/xml/coverage_output.xml'
             cov.xml_report(morfs=coverage_modules, outfile=output_filename)
 
-        if not html_only:
+        output_dir = get_html_directory()
+        if output_dir:
+            html_report(cov, coverage_modules, output_dir)
+            print >>sys.stdout
+            print >>sys.stdout, "Coverage HTML reports were output to '%s'" %output_dir
+
+        if not (html_only and output_dir):
             cov.report(coverage_modules, show_missing=1)
 
-    return results
+class CoverageStage(Stage):
+    """
+    Measures coverage from before the suite is built, so the lines run on
+    import count, and reports on it at the end of the run. The data is
+    saved to .coverage, and if data_suffix is given to
+    .coverage.<data_suffix> too so it can be combined with other runs
+    later. When the tests run in worker processes they measure themselves,
+    and this only measures the suite being built.
+    """
+
+    def __init__(self, xml_out=False, html_only=False, data_suffix=None,
+            in_process=True):
+        self.xml_out = xml_out
+        self.html_only = html_only
+        self.data_suffix = data_suffix
+        self.in_process = in_process
+        self.data_file = None
+        self.cov = None
+
+    def before_discovery(self, run):
+        run.test_labels = run.test_labels or getattr(settings, "TEST_APPS", None)
+        self.coverage_modules = get_coverage_modules_for_labels(run.test_labels,
+            lightweight=run.nodatabase)
+        self.data_file = get_run_data_file()
+        self.cov = make_coverage(self.data_file, data_suffix=True)
+        self.cov.start()
 
+    def before_tests(self, run):
+        if not self.in_process:
+            self.stop()
+
+    def after_tests(self, run):
+        if self.in_process:
+            self.stop()
+
+    def stop(self):
+        self.cov.stop()
+        self.cov.save()
+
+    def report(self, run):
+        cov = combine_coverage(self.data_file, self.data_suffix)
+        report_coverage(cov, self.coverage_modules, self.xml_out, self.html_only)
+
+def run_tests(test_labels, verbosity=1, interactive=True,
+        extra_tests=[], nodatabase=False, xml_out=False, html_only=False,
+        data_suffix=None):
+    """
+    Test runner which displays a code coverage report at the end of the
+    run.
+    """
+    return make_run(test_labels, verbosity, interactive, extra_tests,
+        nodatabase=nodatabase, coverage=True, xmlcoverage=xml_out,
+        html_only=html_only, data_suffix=data_suffix).run()
 
 def run_tests_xml (test_labels, verbosity=1, interactive=True,
-        extra_tests=[], nodatabase=False):
+        extra_tests=[], nodatabase=False, html_only=False,
+        data_suffix=None):
     return run_tests(test_labels, verbosity, interactive,
-               extra_tests, nodatabase, xml_out=True)
+               extra_tests, nodatabase, xml_out=True,
+               html_only=html_only, data_suffix=data_suffix)
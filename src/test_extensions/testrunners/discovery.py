@@ -0,0 +1,379 @@
+"""
+An index of the tests in each app, kept between runs.
+
+Building the tests for an app means importing its tests module, and
+everything that imports, then looking through it for test cases and
+doctests. The index records the ids of the tests each app has, along
+with the modification times and sizes of the files they were built from,
+so listing the tests, working out a shard or building a single test only
+has to import the apps which have changed since. Those files are the
+app's models and tests modules, the modules defining the test classes
+and their base classes, the project modules those import, directly or
+not, and any other project modules first loaded while building the app's
+tests, so tests inherited or imported from elsewhere are picked up when
+they change. The index file is a JSON object mapping app labels to their
+files and (label, test ids) pairs.
+"""
+
+import os
+import sys
+import ast
+import unittest as real_unittest
+
+try:
+    import json
+except ImportError:  # Python < 2.6
+    from django.utils import simplejson as json
+
+from django.conf import settings
+from django.test.simple import build_suite, get_tests
+
+try:
+    # The django.utils.unittest alias is available in Django >= 1.3
+    from django.utils import unittest
+except ImportError:
+    import unittest
+
+from pipeline import flatten_suite, find_app, find_app_name, build_app_test
+
+DEFAULT_INDEX_FILE = 'temp/test_index.json'
+
+def get_index_file():
+    return getattr(settings, 'TEST_INDEX_FILE', DEFAULT_INDEX_FILE)
+
+def app_package(app_label):
+    "Returns the package of the installed app with the given label"
+    return __import__(find_app_name(app_label), {}, {}, [''])
+
+def has_models(app_package):
+    "Whether an app has the models module Django needs to test it"
+    models = os.path.join(os.path.dirname(os.path.abspath(app_package.__file__)),
+        'models')
+    return os.path.isdir(models) or os.path.exists(models + '.py') or \
+        os.path.exists(models + '.pyc')
+
+def app_labels():
+    """
+    Returns the labels of every installed app with a models module, as
+    Django tests them, without importing the models.
+    """
+    return [app_name.split('.')[-1] for app_name in settings.INSTALLED_APPS
+        if has_models(__import__(app_name, {}, {}, ['']))]
+
+def test_label(test, app_label):
+    """
+    Returns a label which builds just the given test, or None if the test
+    can't be built on its own.
+    """
+    dt_test = getattr(test, '_dt_test', None)
+    if dt_test is None:
+        return '.'.join([app_label] + test.id().split('.')[-2:])
+
+    # Doctests are found by their name relative to the models or tests module
+    app_module = find_app(app_label)
+    for module in (app_module, get_tests(app_module)):
+        if module is None:
+            continue
+        prefix = module.__name__ + '.'
+        if dt_test.name.startswith(prefix):
+            name = dt_test.name[len(prefix):]
+            if name.startswith('__test__.'):
+                name = name[len('__test__.'):]
+            if name.count('.') <= 1:
+                return '%s.%s' % (app_label, name)
+    return None
+
+def label_tests(tests, label):
+    """
+    Returns a list of (label, test ids) pairs for the tests built from a
+    label, one per test where possible. If any of the tests can't be built
+    on its own they are all kept together under the label.
+    """
+    app_label = label.split('.')[0]
+    labels = [test_label(test, app_label) for test in tests]
+    if None in labels:
+        return [(label, [test.id() for test in tests])]
+    return [(labels[i], [tests[i].id()]) for i in range(len(tests))]
+
+def _python_files(directory):
+    found = []
+    for path, dirs, files in os.walk(directory):
+        found.extend([os.path.join(path, name) for name in files
+            if name.endswith('.py')])
+    return found
+
+def app_test_files(app_package):
+    """
+    Returns the files an app's tests are built from: its models module and
+    its tests module, either of which may be a package, whether or not
+    they exist yet.
+    """
+    directory = os.path.dirname(os.path.abspath(app_package.__file__))
+    files = []
+    for name in ('models', 'tests'):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            files.extend(_python_files(path))
+        else:
+            files.append(path + '.py')
+    return files
+
+def source_file(module):
+    "Returns the absolute path of a module's source, or None if it has none"
+    file_name = getattr(module, '__file__', None)
+    if not file_name:
+        return None
+    root, ext = os.path.splitext(os.path.abspath(file_name))
+    if ext in ('.pyc', '.pyo'):
+        return root + '.py'
+    return root + ext
+
+def get_project_directory():
+    "The directory of the settings module, or the current directory"
+    settings_module = sys.modules.get(getattr(settings, 'SETTINGS_MODULE', None))
+    file_name = source_file(settings_module)
+    if file_name is None:
+        return os.getcwd()
+    return os.path.dirname(file_name)
+
+def is_project_file(file_name):
+    return file_name.startswith(os.path.join(get_project_directory(), ''))
+
+def project_files(modules):
+    "Returns the source files of those of the given modules in the project"
+    files = [source_file(module) for module in modules]
+    return [file_name for file_name in files
+        if file_name and is_project_file(file_name)]
+
+def test_class_files(tests):
+    """
+    Returns the source files defining the classes of the given tests and
+    their base classes, and the files doctests were found in.
+    """
+    files = set()
+    for test in tests:
+        dt_test = getattr(test, '_dt_test', None)
+        if dt_test is not None and dt_test.filename:
+            files.add(os.path.abspath(dt_test.filename))
+        for cls in type(test).__mro__:
+            file_name = source_file(sys.modules.get(cls.__module__))
+            if file_name:
+                files.add(file_name)
+    return list(files)
+
+def imported_names(source, package):
+    """
+    Returns the names of the modules the given module source may import,
+    including the names implicit relative imports from within the package
+    would have, and the submodules from imports might be.
+    """
+    names = set()
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            bases = [alias.name for alias in node.names]
+            members = []
+        elif isinstance(node, ast.ImportFrom):
+            bases = [node.module or '']
+            members = [alias.name for alias in node.names]
+        else:
+            continue
+        level = getattr(node, 'level', 0)
+        if level:
+            parts = package.split('.')
+            prefix = '.'.join(parts[:len(parts) - level + 1])
+            bases = ['.'.join([part for part in (prefix, base) if part])
+                for base in bases]
+        elif package:
+            bases = bases + ['%s.%s' % (package, base) for base in bases if base]
+        for base in bases:
+            names.add(base)
+            names.update(['%s.%s' % (base, member) for member in members])
+    names.discard('')
+    return names
+
+class ImportGraph(object):
+    """
+    The project files imported by each project file, worked out from the
+    import statements in their source and the modules loaded so far.
+    """
+
+    def __init__(self, is_project_file):
+        self.is_project_file = is_project_file
+        self.modules = {}
+        for name, module in sys.modules.items():
+            file_name = source_file(module)
+            if file_name and is_project_file(file_name):
+                self.modules[name] = file_name
+        self.packages = {}
+        for name, file_name in self.modules.items():
+            if os.path.basename(file_name).startswith('__init__.'):
+                self.packages[file_name] = name
+            else:
+                self.packages[file_name] = name.rpartition('.')[0]
+        self.direct = {}
+
+    def direct_imports(self, file_name):
+        "Returns the project files a project file imports itself"
+        if file_name not in self.direct:
+            try:
+                module_file = open(file_name)
+                try:
+                    names = imported_names(module_file.read(),
+                        self.packages.get(file_name, ''))
+                finally:
+                    module_file.close()
+            except (IOError, SyntaxError):
+                names = ()
+            self.direct[file_name] = set([self.modules[name]
+                for name in names if name in self.modules])
+        return self.direct[file_name]
+
+    def imports(self, file_names):
+        "Returns the given files and the project files they import, directly or not"
+        found = set()
+        pending = [file_name for file_name in file_names
+            if self.is_project_file(file_name)]
+        while pending:
+            file_name = pending.pop()
+            if file_name not in found:
+                found.add(file_name)
+                pending.extend(self.direct_imports(file_name) - found)
+        return found
+
+def file_stamps(file_names):
+    "Returns a dictionary of file name to [mtime, size] for the files that exist"
+    stamps = {}
+    for file_name in file_names:
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            continue
+        stamps[file_name] = [stat.st_mtime, stat.st_size]
+    return stamps
+
+class DiscoveryIndex(object):
+    """
+    The tests found in each app, rebuilt for an app when any of the files
+    its tests were built from change. Call save() to keep any changes for
+    next time.
+    """
+
+    def __init__(self, file_name=None):
+        self.file_name = file_name or get_index_file()
+        self.apps = {}
+        self.changed = False
+        # Apps share most of their files, so each is only looked at once
+        self.stamps = {}
+        if os.path.exists(self.file_name):
+            index_file = open(self.file_name)
+            try:
+                try:
+                    self.apps = json.load(index_file)
+                except ValueError:
+                    # Start again from a damaged index
+                    pass
+            finally:
+                index_file.close()
+
+    def file_stamps(self, file_names):
+        missing = [file_name for file_name in file_names
+            if file_name not in self.stamps]
+        if missing:
+            self.stamps.update(dict.fromkeys(missing))
+            self.stamps.update(file_stamps(missing))
+        return dict([(file_name, self.stamps[file_name])
+            for file_name in file_names if self.stamps[file_name] is not None])
+
+    def app_tests(self, app_label):
+        """
+        Returns the (label, test ids) pairs for every test in an app. Only
+        the app's package is imported unless its entry is out of date.
+        """
+        files = app_test_files(app_package(app_label))
+        entry = self.apps.get(app_label)
+        if entry is None or \
+                entry['files'] != self.file_stamps(set(files) | set(entry['files'])):
+            loaded = set(sys.modules)
+            tests = flatten_suite(build_suite(find_app(app_label)))
+            imported = [sys.modules[name] for name in set(sys.modules) - loaded]
+            class_files = test_class_files(tests)
+            files = set(files) | set(project_files(imported)) | \
+                ImportGraph(is_project_file).imports(class_files)
+            entry = {'files': self.file_stamps(files),
+                'tests': label_tests(tests, app_label)}
+            self.apps[app_label] = entry
+            self.changed = True
+        return [(label, test_ids) for label, test_ids in entry['tests']]
+
+    def lookup(self, label):
+        """
+        Returns the (label, test ids) pairs for the tests a label builds.
+        Labels the index can't answer for, such as a test in an app with
+        tests that can't be built on their own, are built from scratch.
+        """
+        app_label = label.split('.')[0]
+        if '.' not in label:
+            return self.app_tests(app_label)
+        matching = [(test_label, test_ids)
+            for test_label, test_ids in self.app_tests(app_label)
+            if test_label == label or test_label.startswith(label + '.')]
+        if matching:
+            return matching
+        # Raises the usual error for a label which doesn't exist
+        return label_tests(flatten_suite(build_app_test(label)), label)
+
+    def build_test(self, label):
+        """
+        Builds the tests for an app.TestClass or app.TestClass.test_method
+        label from their ids in the index, only importing the modules they
+        are defined in. Returns None if the label names anything else, such
+        as a doctest.
+        """
+        tests = []
+        for test_label, test_ids in self.lookup(label):
+            for test_id in test_ids:
+                parts = test_id.rsplit('.', 2)
+                if len(parts) < 3:
+                    return None
+                module_name, class_name, method_name = parts
+                try:
+                    module = __import__(module_name, {}, {}, [''])
+                except ImportError:
+                    return None
+                TestClass = getattr(module, class_name, None)
+                if not (isinstance(TestClass, type) and
+                        issubclass(TestClass, (unittest.TestCase, real_unittest.TestCase)) and
+                        hasattr(TestClass, method_name)):
+                    return None
+                tests.append(TestClass(method_name))
+        return unittest.TestSuite(tests)
+
+    def save(self):
+        if not self.changed:
+            return
+        directory = os.path.dirname(self.file_name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        index_file = open(self.file_name, 'w')
+        try:
+            json.dump(self.apps, index_file)
+        finally:
+            index_file.close()
+        self.changed = False
+
+def collect_tests(test_labels, index=None):
+    """
+    Returns the (label, test ids) pairs for the given labels, or for every
+    installed app, using the index where it is up to date.
+    """
+    index = index or DiscoveryIndex()
+    collected = []
+    for label in test_labels or app_labels():
+        collected.extend(index.lookup(label))
+    index.save()
+    return collected
+
+def list_tests(test_labels):
+    "Returns the ids of the tests for the given labels, or every installed app"
+    return [test_id for label, test_ids in collect_tests(test_labels)
+        for test_id in test_ids]
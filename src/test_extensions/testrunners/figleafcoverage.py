@@ -1,19 +1,100 @@
 import os
-import commands
+import sys
+import time
 
-from django.test.utils import setup_test_environment, teardown_test_environment
-from django.test.simple import run_tests as django_test_runner
+from django.conf import settings
+from django.db.models import get_app, get_apps
 
 import figleaf
- 
+from figleaf.annotate_html import report_as_html
+
+from pipeline import Stage, TestDatabases, make_run
+
+OUTPUT_DIRECTORY = os.path.join("temp", "figleaf")
+
+def get_app_sources(test_labels):
+    """
+    Returns the absolute paths of the Python files in the apps being
+    tested, or in every installed app if no labels are given.
+    """
+    if test_labels:
+        apps = [get_app(label.split('.')[0]) for label in test_labels]
+    else:
+        apps = get_apps()
+    sources = {}
+    for app in apps:
+        app_directory = os.path.dirname(os.path.abspath(app.__file__))
+        for directory, dirs, files in os.walk(app_directory):
+            for file_name in files:
+                if file_name.endswith('.py'):
+                    sources[os.path.join(directory, file_name)] = 1
+    return sources
+
+def write_report(coverage, directory, files_list=None):
+    """
+    Writes figleaf's HTML report of the coverage data, in the same process
+    rather than through figleaf2html. With a files_list only those files
+    are reported on.
+    """
+    # figleaf records file names as they were imported, often relative
+    by_path = {}
+    for file_name, lines in coverage.items():
+        by_path.setdefault(os.path.abspath(file_name), set()).update(lines)
+    report_as_html(by_path, directory, [], files_list or {})
+
+class FigleafStage(Stage):
+    """
+    Records coverage with figleaf from before the suite is built and
+    writes its HTML report to temp/figleaf at the end, printing how long
+    setting up and building the suite, creating and destroying the test
+    databases, running the tests and writing the report took. With the
+    FIGLEAF_TESTED_APPS_ONLY setting the report only covers the source of
+    the apps tested.
+    """
+
+    def before_discovery(self, run):
+        self.timings = []
+        self.databases = [stage for stage in run.stages
+            if isinstance(stage, TestDatabases)]
+        self.started = time.time()
+        figleaf.start()
+
+    def after_discovery(self, run, suite):
+        # The test databases are set up between here and before_tests
+        self.timings.append(('setup', time.time() - self.started))
+        self.started = time.time()
+        return suite
+
+    def before_tests(self, run):
+        self.database_time = time.time() - self.started
+        self.started = time.time()
+
+    def after_tests(self, run):
+        figleaf.stop()
+        self.timings.append(('tests', time.time() - self.started))
+        # and torn down between here and report
+        self.started = time.time()
+
+    def report(self, run):
+        started = time.time()
+        if self.databases:
+            self.timings.insert(1, ('databases',
+                self.database_time + started - self.started))
+        if not os.path.isdir(OUTPUT_DIRECTORY):
+            os.makedirs(OUTPUT_DIRECTORY)
+        file_name = os.path.join(OUTPUT_DIRECTORY, "test_output.figleaf")
+        figleaf.write_coverage(file_name)
+        files_list = None
+        if getattr(settings, 'FIGLEAF_TESTED_APPS_ONLY', False):
+            files_list = get_app_sources(run.test_labels)
+        write_report(figleaf.read_coverage(file_name), OUTPUT_DIRECTORY, files_list)
+        self.timings.append(('report', time.time() - started))
+
+        print >>sys.stdout
+        print >>sys.stdout, "Figleaf HTML report was output to '%s'" % OUTPUT_DIRECTORY
+        print >>sys.stdout, ', '.join(['%s %.2fs' % timing for timing in self.timings])
+
 def run_tests(test_labels, verbosity=1, interactive=True, extra_tests=[]):
-    setup_test_environment()
-    figleaf.start()
-    test_results = django_test_runner(test_labels, verbosity, interactive, extra_tests)
-    figleaf.stop()
-    if not os.path.isdir(os.path.join("temp", "figleaf")): os.makedirs(os.path.join("temp", "figleaf"))
-    file_name = "temp/figleaf/test_output.figleaf"
-    figleaf.write_coverage(file_name)
-    output = commands.getoutput("figleaf2html " + file_name + " --output-directory=temp/figleaf")
-    print output
-    return test_results
\ No newline at end of file
+    "Test runner which writes a figleaf HTML coverage report"
+    return make_run(test_labels, verbosity, interactive, extra_tests,
+        figleaf=True).run()
@@ -0,0 +1,161 @@
+"""
+Incremental HTML coverage reports.
+
+Builds on coverage's own HTML reporter, which keeps a manifest in the
+report directory of a hash of each file's source and coverage data, but
+only checks it after analysing each file. Here the hashes are checked
+before any file is analysed, so files which haven't changed since the
+last report cost a read and a hash rather than a full analysis, and
+their pages are left as they are. The pages for the files which have
+changed are rendered by a pool of worker processes.
+
+This relies on the internals of coverage 3.5 to 3.7, and other versions
+write their report as usual.
+"""
+
+import os
+import re
+import copy
+import multiprocessing
+
+import coverage
+from django.conf import settings
+
+# Below this many changed files it isn't worth starting worker processes
+MIN_FILES_PER_PROCESS = 20
+
+_reporter = None
+
+def _render(index):
+    """
+    Renders the page for one code unit in a worker process, returning its
+    manifest entry for the parent to record.
+    """
+    reporter = _reporter
+    code_unit = reporter.code_units[index]
+    reporter.files = []
+    if not reporter.render(code_unit):
+        return None
+    flat_rootname = code_unit.flat_rootname()
+    return (flat_rootname, reporter.status.file_hash(flat_rootname),
+        reporter.files[0])
+
+COVERAGE_VERSION = tuple([int(part) for part in
+    re.match(r'(\d+)\.(\d+)', coverage.__version__).groups()])
+
+if (3, 5) <= COVERAGE_VERSION < (4, 0):
+    from coverage.html import HtmlReporter
+    from coverage.misc import CoverageException, NoSource, NotPython
+
+    class IncrementalHtmlReporter(HtmlReporter):
+        def __init__(self, cov, config, processes=1):
+            HtmlReporter.__init__(self, cov, config)
+            self.processes = processes
+
+        def is_unchanged(self, code_unit):
+            "Whether the page for a code unit is still up to date"
+            try:
+                source_file = code_unit.source_file()
+            except NoSource:
+                # Let the analysis report the problem
+                return False
+            try:
+                source = source_file.read()
+            finally:
+                source_file.close()
+            flat_rootname = code_unit.flat_rootname()
+            if self.file_hash(source, code_unit) != self.status.file_hash(flat_rootname):
+                return False
+            return os.path.exists(os.path.join(self.directory,
+                flat_rootname + '.html'))
+
+        def render(self, code_unit):
+            "Writes the page for a code unit, returning whether there is one"
+            try:
+                self.html_file(code_unit, self.coverage._analyze(code_unit))
+            except NoSource:
+                if not self.config.ignore_errors:
+                    raise
+                return False
+            except NotPython:
+                if code_unit.should_be_python() and not self.config.ignore_errors:
+                    raise
+                return False
+            return True
+
+        def report_files(self, report_fn, morfs, directory=None):
+            global _reporter
+            self.find_code_units(morfs)
+            if not self.code_units:
+                raise CoverageException("No data to report.")
+
+            self.directory = directory
+            if self.directory and not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+
+            entries = [None] * len(self.code_units)
+            changed = []
+            for index, code_unit in enumerate(self.code_units):
+                if self.is_unchanged(code_unit):
+                    entries[index] = self.status.index_info(
+                        code_unit.flat_rootname())
+                else:
+                    changed.append(index)
+
+            processes = min(self.processes,
+                len(changed) // MIN_FILES_PER_PROCESS)
+            if processes > 1:
+                _reporter = self
+                pool = multiprocessing.Pool(processes)
+                try:
+                    rendered = pool.map(_render, changed,
+                        max(1, len(changed) // (processes * 4)))
+                finally:
+                    pool.close()
+                    pool.join()
+                    _reporter = None
+                for index, result in zip(changed, rendered):
+                    if result is not None:
+                        flat_rootname, file_hash, index_info = result
+                        self.status.set_file_hash(flat_rootname, file_hash)
+                        self.status.set_index_info(flat_rootname, index_info)
+                        entries[index] = index_info
+            else:
+                for index in changed:
+                    self.files = []
+                    if self.render(self.code_units[index]):
+                        entries[index] = self.files[0]
+
+            self.files = [entry for entry in entries if entry is not None]
+else:
+    IncrementalHtmlReporter = None
+
+def get_html_directory():
+    "Returns the directory to write the HTML report to, or None for no report"
+    if getattr(settings, "COVERAGE_HTML_REPORT", False) or \
+            os.environ.get("COVERAGE_HTML_REPORT"):
+        return getattr(settings, "COVERAGE_HTML_DIRECTORY", "covhtml")
+    return None
+
+def get_html_processes():
+    processes = getattr(settings, 'COVERAGE_HTML_PROCESSES', None)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    return processes
+
+def html_report(cov, morfs, directory, processes=None):
+    """
+    Writes the HTML report for the given modules to directory, only
+    rendering the pages for files which have changed since last time.
+    """
+    if IncrementalHtmlReporter is None:
+        return cov.html_report(morfs=morfs, directory=directory)
+    if processes is None:
+        processes = get_html_processes()
+    cov._harvest_data()
+    cov.config.from_args(html_dir=directory)
+    # The manifest is thrown away when the settings change, and the data
+    # file is named differently every run without affecting the pages
+    config = copy.copy(cov.config)
+    config.data_file = None
+    return IncrementalHtmlReporter(cov, config, processes).report(morfs)
@@ -0,0 +1,382 @@
+"""
+Change-impact test selection. Needs Django 1.3 or later.
+
+When recording, each test is run under coverage on its own and the
+source lines it executes are kept in an index, along with a fingerprint
+of every file involved. With --changed only the tests which executed a
+line that has changed since the last run are run, plus any new tests and
+those that failed last time.
+
+Changed lines are found by diffing a hash of each line against the
+fingerprint. Module level code runs when the tests are built rather than
+while they run, so each test is also recorded as touching every project
+file its module imports, directly or not, and the lines run while
+importing them are kept too. Changes to those lines, or to lines no test
+executes, select every test which touched the file. A change to a project
+file outside the index, such as the settings, selects every test.
+"""
+
+import os
+import time
+import difflib
+import hashlib
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from django.conf import settings
+
+try:
+    # The django.utils.unittest alias is available in Django >= 1.3
+    from django.utils import unittest
+except ImportError:
+    import unittest
+
+from discovery import collect_tests, test_class_files, ImportGraph
+
+DEFAULT_IMPACT_FILE = 'temp/test_impact.pickle'
+
+def get_impact_file():
+    return getattr(settings, 'TEST_IMPACT_FILE', DEFAULT_IMPACT_FILE)
+
+def load_index(file_name=None):
+    """
+    Returns the impact index, a dictionary with these entries:
+
+     - files maps each file name to its (mtime, md5, line hashes)
+     - tests maps each test id to (failed, {file name: set of lines})
+     - imports maps file names to the set of lines run importing them
+     - source lists the directories recorded
+     - time is when the recording started
+    """
+    file_name = file_name or get_impact_file()
+    index = {'files': {}, 'tests': {}, 'imports': {}, 'source': [], 'time': None}
+    if os.path.exists(file_name):
+        index_file = open(file_name, 'rb')
+        try:
+            index.update(pickle.load(index_file))
+        finally:
+            index_file.close()
+    return index
+
+def save_index(index, file_name=None):
+    file_name = file_name or get_impact_file()
+    directory = os.path.dirname(file_name)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp_name = '%s.%d' % (file_name, os.getpid())
+    index_file = open(temp_name, 'wb')
+    try:
+        pickle.dump(index, index_file, pickle.HIGHEST_PROTOCOL)
+    finally:
+        index_file.close()
+    os.rename(temp_name, file_name)
+
+def fingerprint(file_name):
+    "Returns (mtime, md5, line hashes) for a file, or None if it is gone"
+    try:
+        mtime = os.stat(file_name).st_mtime
+        source_file = open(file_name, 'rb')
+    except (IOError, OSError):
+        return None
+    try:
+        source = source_file.read()
+    finally:
+        source_file.close()
+    return (mtime, hashlib.md5(source).hexdigest(),
+        [zlib.crc32(line) for line in source.splitlines()])
+
+def diff_file(old, new):
+    """
+    Compares two fingerprints of a file, returning the set of old line
+    numbers which have changed and a map of old to new line numbers for
+    the rest.
+    """
+    matcher = difflib.SequenceMatcher(None, old[2], new[2])
+    changed, moved = set(), {}
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            for offset in range(i2 - i1):
+                moved[i1 + offset + 1] = j1 + offset + 1
+        elif i1 == i2:
+            # Lines inserted between old lines i1 and i1 + 1
+            changed.update([i1, i1 + 1])
+        else:
+            changed.update(range(i1 + 1, i2 + 1))
+    return changed, moved
+
+def python_files(directories):
+    "Returns the Python source files below the given directories"
+    found = []
+    for directory in directories:
+        for path, dirs, files in os.walk(directory):
+            found.extend([os.path.join(path, name) for name in files
+                if name.endswith('.py')])
+    return found
+
+def unindexed_changes(index):
+    """
+    Returns the project files outside the index which have been changed
+    or added since the recording started.
+    """
+    if index['time'] is None:
+        return []
+    changed = []
+    for file_name in python_files(index['source']):
+        if file_name in index['files']:
+            continue
+        try:
+            if os.stat(file_name).st_mtime >= index['time']:
+                changed.append(file_name)
+        except OSError:
+            pass
+    return changed
+
+def find_changes(index):
+    """
+    Returns a dictionary mapping each indexed file which has changed to
+    its (changed lines, moved lines, new fingerprint). Files which are gone,
+    or whose changes include lines run on import or lines which no test
+    executes, have None for their changed lines, meaning every test
+    touching them is affected. Files which were only touched have None for
+    their moved lines, as nothing has moved.
+
+    If a project file outside the index has changed, there is an entry
+    for None with no changed lines either, and every test is affected.
+    """
+    changes = {}
+    for file_name, old in index['files'].items():
+        try:
+            if os.stat(file_name).st_mtime == old[0]:
+                continue
+        except OSError:
+            changes[file_name] = (None, {}, None)
+            continue
+        new = fingerprint(file_name)
+        if new is None:
+            changes[file_name] = (None, {}, None)
+        elif new[1] != old[1]:
+            changed, moved = diff_file(old, new)
+            changes[file_name] = (changed, moved, new)
+        else:
+            # Only touched, so just remember the new mtime
+            changes[file_name] = (set(), None, new)
+
+    covered = {}
+    for failed, lines in index['tests'].values():
+        for file_name in changes:
+            if file_name in lines:
+                covered.setdefault(file_name, set()).update(lines[file_name])
+    for file_name, (changed, moved, new) in changes.items():
+        if changed and (changed - covered.get(file_name, set()) or
+                changed & index['imports'].get(file_name, set())):
+            changes[file_name] = (None, moved, new)
+
+    if unindexed_changes(index):
+        changes[None] = (None, None, None)
+    return changes
+
+def is_affected(entry, changes):
+    "Whether a test with the given index entry needs to run again"
+    if entry is None or None in changes:
+        return True
+    failed, lines = entry
+    if failed:
+        return True
+    for file_name, file_lines in lines.items():
+        if file_name in changes:
+            changed = changes[file_name][0]
+            if changed is None or changed & file_lines:
+                return True
+    return False
+
+def get_changed_labels(test_labels, reloaded=()):
+    """
+    Returns the labels to hand to the runner to run just the tests for the
+    given labels affected by changes since the last run, along with any
+    which touch the files of the given reloaded modules.
+    """
+    index = load_index()
+    changes = find_changes(index)
+    for file_name in reloaded:
+        changes.setdefault(file_name, (None, None, None))
+    selected = []
+    for label, test_ids in collect_tests(test_labels):
+        for test_id in test_ids:
+            if is_affected(index['tests'].get(test_id), changes):
+                selected.append(label)
+                break
+    return selected
+
+def move_lines(lines, changes):
+    """
+    Moves the {file name: set of lines} kept from an earlier run to where
+    the lines are now in any file that has changed, dropping files which
+    are gone.
+    """
+    for changed_file, (changed, moved, new) in changes.items():
+        if changed_file in lines and moved is not None:
+            if new is None:
+                del lines[changed_file]
+            else:
+                lines[changed_file] = set([moved[line]
+                    for line in lines[changed_file] if line in moved])
+    return lines
+
+def update_index(recorder, file_name=None):
+    """
+    Merges the lines recorded for the tests of this run into the index.
+
+    Tests which weren't run keep their lines, moved to where they are now
+    in any file that has changed, as do the lines run importing the files
+    which weren't imported again.
+    """
+    index = load_index(file_name)
+    changes = find_changes(index)
+
+    tests = {}
+    for test_id, (failed, lines) in index['tests'].items():
+        if test_id not in recorder.recorded:
+            tests[test_id] = (failed, move_lines(lines, changes))
+    tests.update(recorder.recorded)
+    imports = move_lines(index['imports'], changes)
+    imports.update(recorder.import_lines)
+
+    files = {}
+    for lines in [lines for failed, lines in tests.values()] + [imports]:
+        for source_file in lines:
+            if source_file not in files:
+                if source_file in index['files'] and source_file not in changes:
+                    files[source_file] = index['files'][source_file]
+                else:
+                    files[source_file] = fingerprint(source_file)
+    for source_file in [f for f in files if files[f] is None]:
+        del files[source_file]
+    imports = dict([(source_file, lines) for source_file, lines in imports.items()
+        if source_file in files])
+
+    save_index({'files': files, 'tests': tests, 'imports': imports,
+        'source': recorder.source, 'time': recorder.started}, file_name)
+
+class ImpactRecorder(object):
+    """
+    Records the project source lines run while building the tests, and
+    those executed by each test along with the files its module imports.
+    """
+
+    def __init__(self, source=None):
+        import coverage
+        self.source = [os.path.abspath(directory)
+            for directory in source or [os.getcwd()]]
+        self.cov = coverage.coverage(source=self.source)
+        self.cov.use_cache(0)
+        # Plenty of tests, and rebuilds of modules already imported, run no
+        # project code at all
+        self.cov._warn_no_data = False
+        self.started = time.time()
+        self.recorded = {}
+        self.import_lines = {}
+        self.graph = None
+
+    def is_project_file(self, file_name):
+        for directory in self.source:
+            if file_name.startswith(os.path.join(directory, '')):
+                return True
+        return False
+
+    def _collect(self):
+        self.cov.stop()
+        # Saving without a data file just gathers up the collected lines
+        self.cov.save()
+        lines = {}
+        for file_name, file_lines in self.cov.data.line_data().items():
+            # Source files the test never ran are listed too
+            if file_lines:
+                lines[file_name] = set(file_lines)
+        return lines
+
+    def start_imports(self):
+        "Call before building the tests, so the modules imported are recorded"
+        self.cov.erase()
+        self.cov.start()
+
+    def stop_imports(self):
+        self.import_lines.update(self._collect())
+
+    def start(self, test):
+        self.cov.erase()
+        self.cov.start()
+
+    def stop(self, test, failed):
+        lines = self._collect()
+        if self.graph is None:
+            self.graph = ImportGraph(self.is_project_file)
+        for file_name in self.graph.imports(test_class_files([test])):
+            lines.setdefault(file_name, set())
+        self.recorded[test.id()] = (failed, lines)
+
+class ImpactTestResult(unittest.TextTestResult):
+    recorder = None
+
+    def startTest(self, test):
+        self._problems = len(self.failures) + len(self.errors)
+        unittest.TextTestResult.startTest(self, test)
+        self.recorder.start(test)
+
+    def stopTest(self, test):
+        self.recorder.stop(test,
+            len(self.failures) + len(self.errors) > self._problems)
+        unittest.TextTestResult.stopTest(self, test)
+
+class ImpactTestRunner(unittest.TextTestRunner):
+    def __init__(self, recorder, **kwargs):
+        unittest.TextTestRunner.__init__(self, **kwargs)
+        self.recorder = recorder
+
+    def _makeResult(self):
+        result = ImpactTestResult(self.stream, self.descriptions, self.verbosity)
+        result.recorder = self.recorder
+        return result
+
+try:
+    from django.test.simple import DjangoTestSuiteRunner
+
+    class ImpactTestSuiteRunner(DjangoTestSuiteRunner):
+        """
+        Test runner which records the lines each test executes in the
+        impact index as it runs.
+        """
+
+        def __init__(self, verbosity=1, interactive=True, failfast=True,
+                nodatabase=False, **kwargs):
+            super(ImpactTestSuiteRunner, self).__init__(verbosity, interactive,
+                failfast, **kwargs)
+            self.nodatabase = nodatabase
+
+        def setup_databases(self, **kwargs):
+            if self.nodatabase:
+                return None
+            return super(ImpactTestSuiteRunner, self).setup_databases(**kwargs)
+
+        def teardown_databases(self, old_config, **kwargs):
+            if old_config is not None:
+                super(ImpactTestSuiteRunner, self).teardown_databases(old_config, **kwargs)
+
+        def build_suite(self, *args, **kwargs):
+            self.recorder = ImpactRecorder(getattr(settings, 'TEST_IMPACT_SOURCE', None))
+            self.recorder.start_imports()
+            try:
+                return super(ImpactTestSuiteRunner, self).build_suite(*args, **kwargs)
+            finally:
+                self.recorder.stop_imports()
+
+        def run_suite(self, suite, **kwargs):
+            result = ImpactTestRunner(self.recorder, verbosity=self.verbosity,
+                failfast=self.failfast).run(suite)
+            update_index(self.recorder)
+            return result
+except ImportError:  # DjangoTestSuiteRunner is not available in Django < 1.2
+    pass
@@ -0,0 +1,385 @@
+"""
+Test runner that splits the suite across a number of worker processes.
+
+Each worker gets its own test database, named after the main test
+database with the worker number appended, and streams the outcome of
+every test back to the parent process which prints the combined results.
+"""
+
+import os
+import sys
+import time
+import traceback
+import multiprocessing
+from Queue import Empty
+
+from django.conf import settings
+
+try:
+    # The django.utils.unittest alias is available in Django >= 1.3
+    from django.utils import unittest
+except ImportError:
+    import unittest
+
+# Django versions prior to 1.2 don't include the DjangoTestSuiteRunner class
+# or multi-database support.
+try:
+    from django.test.simple import DjangoTestSuiteRunner
+except ImportError:
+    DjangoTestSuiteRunner = None
+
+from xmloutput import XMLTestRunner, DEFAULT_XML_OUTPUT
+from timings import load_timings, save_timings
+from pipeline import make_run, flatten_suite
+from xmlunit.unittest import _WritelnDecorator
+
+separator1 = '=' * 70
+separator2 = '-' * 70
+
+def test_group(test):
+    """
+    Returns the key tests are grouped by when splitting the suite: the
+    test class for unit tests and the module for doctests.
+    """
+    return test.id().rsplit('.', 1)[0]
+
+def split_tests(tests, processes, timings=None):
+    """
+    Splits a list of tests into at most the given number of chunks.
+
+    Tests from the same group are kept together so class level fixtures
+    are only set up once. Groups are handed out longest first to the chunk
+    with the least work so far, measured using the recorded timings where
+    there are any and by counting tests otherwise. Tests keep their
+    original relative order within a chunk.
+    """
+    timings = timings or {}
+    default = timings and sum(timings.values()) / len(timings) or 1.0
+
+    groups = {}
+    for index, test in enumerate(tests):
+        groups.setdefault(test_group(test), []).append(index)
+
+    weighted = []
+    for indexes in groups.values():
+        weight = sum([timings.get(tests[index].id(), default) for index in indexes])
+        weighted.append((weight, indexes))
+    weighted.sort(reverse=True)
+
+    totals = [0.0] * processes
+    chunks = [[] for i in range(processes)]
+    for weight, indexes in weighted:
+        smallest = totals.index(min(totals))
+        totals[smallest] += weight
+        chunks[smallest].extend(indexes)
+
+    return [[tests[index] for index in sorted(chunk)] for chunk in chunks if chunk]
+
+def worker_database_name(name, worker):
+    "Returns the name of the test database used by the given worker"
+    if not name or name == ':memory:':
+        # In-memory databases are already private to each process
+        return name
+    return '%s_%d' % (name, worker)
+
+def worker_output_file(file_name, worker):
+    "Returns the xml report file name used by the given worker"
+    root, ext = os.path.splitext(file_name)
+    return '%s_%d%s' % (root, worker, ext)
+
+def setup_worker_databases(worker):
+    """
+    Creates the test databases for a worker, returning whatever
+    teardown_worker_databases needs to destroy them again.
+
+    Workers can't prompt for input, so existing databases left behind by
+    a previous run are always clobbered.
+    """
+    if DjangoTestSuiteRunner is None:
+        from django.db import connection
+        from django.db.backends.creation import TEST_DATABASE_PREFIX
+        old_name = settings.DATABASE_NAME
+        if settings.DATABASE_ENGINE != 'sqlite3' or settings.TEST_DATABASE_NAME:
+            test_name = settings.TEST_DATABASE_NAME or TEST_DATABASE_PREFIX + old_name
+            settings.TEST_DATABASE_NAME = worker_database_name(test_name, worker)
+        connection.creation.create_test_db(0, autoclobber=True)
+        return old_name
+
+    from django.db import connections
+    for alias in connections:
+        connection = connections[alias]
+        connection.settings_dict['TEST_NAME'] = worker_database_name(
+            connection.creation._get_test_db_name(), worker)
+    return DjangoTestSuiteRunner(verbosity=0, interactive=False).setup_databases()
+
+def teardown_worker_databases(old_config):
+    if DjangoTestSuiteRunner is None:
+        from django.db import connection
+        connection.creation.destroy_test_db(old_config, 0)
+    else:
+        DjangoTestSuiteRunner(verbosity=0).teardown_databases(old_config)
+
+def close_connections():
+    "Close database connections so forked workers don't share sockets"
+    try:
+        from django.db import connections
+        for alias in connections:
+            connections[alias].close()
+    except ImportError:
+        from django.db import connection
+        connection.close()
+
+def get_description(test):
+    doc_first_line = test.shortDescription()
+    if doc_first_line:
+        return '\n'.join((str(test), doc_first_line))
+    return str(test)
+
+class StreamingResult(object):
+    """
+    Wraps the test result used by a worker, passing every outcome on to
+    the parent process through a queue as it happens.
+    """
+
+    def __init__(self, result, queue, worker, stop_event):
+        self.result = result
+        self.queue = queue
+        self.worker = worker
+        self.stop_event = stop_event
+
+    def __getattr__(self, attr):
+        return getattr(self.result, attr)
+
+    def _send(self, outcome, test, details=''):
+        self.queue.put((outcome, self.worker, get_description(test), details,
+            test.id(), time.time() - self._startTime))
+
+    def startTest(self, test):
+        if self.stop_event.is_set():
+            self.result.stop()
+        self._startTime = time.time()
+        self.result.startTest(test)
+
+    def addSuccess(self, test):
+        self.result.addSuccess(test)
+        self._send('ok', test)
+
+    def addError(self, test, err):
+        self.result.addError(test, err)
+        self._send('ERROR', test, self.result._exc_info_to_string(err, test))
+
+    def addFailure(self, test, err):
+        self.result.addFailure(test, err)
+        self._send('FAIL', test, self.result._exc_info_to_string(err, test))
+
+    def addSkip(self, test, reason):
+        addSkip = getattr(self.result, 'addSkip', None)
+        if addSkip is None:
+            self.result.addSuccess(test)
+        else:
+            addSkip(test, reason)
+        self._send('skipped', test, reason)
+
+    def addExpectedFailure(self, test, err):
+        self.result.addExpectedFailure(test, err)
+        self._send('expected failure', test)
+
+    def addUnexpectedSuccess(self, test):
+        self.result.addUnexpectedSuccess(test)
+        self._send('unexpected success', test)
+
+class StreamingXMLTestRunner(XMLTestRunner):
+    "XML test runner whose results are also streamed to the parent process"
+
+    def __init__(self, queue, worker, stop_event, **kwargs):
+        XMLTestRunner.__init__(self, **kwargs)
+        self.queue = queue
+        self.worker = worker
+        self.stop_event = stop_event
+
+    # The parent process records the timings for the whole run
+    record_timings = False
+
+    def _makeResult(self):
+        return StreamingResult(XMLTestRunner._makeResult(self),
+            self.queue, self.worker, self.stop_event)
+
+def run_worker(worker, tests, queue, stop_event, verbosity=1,
+        nodatabase=False, xml_out=False, xml_output=DEFAULT_XML_OUTPUT,
+        coverage_file=None):
+    """
+    Runs a chunk of the suite inside a worker process. Always finishes by
+    sending a 'done' message with the number of tests run.
+
+    With a coverage_file the worker measures coverage, saving its data to
+    a file of its own next to it.
+    """
+    tests_run = 0
+    try:
+        if coverage_file:
+            from codecoverage import make_coverage
+            cov = make_coverage(coverage_file, data_suffix=True)
+            cov.start()
+        if not nodatabase:
+            old_config = setup_worker_databases(worker)
+
+        suite = unittest.TestSuite(tests)
+        if xml_out:
+            runner = StreamingXMLTestRunner(queue, worker, stop_event,
+                verbosity=verbosity,
+                outputFileName=worker_output_file(xml_output, worker))
+            result = runner.run(suite)
+        else:
+            result = StreamingResult(unittest.TestResult(), queue, worker,
+                stop_event)
+            suite.run(result)
+        tests_run = result.testsRun
+
+        if not nodatabase:
+            teardown_worker_databases(old_config)
+        if coverage_file:
+            cov.stop()
+            cov.save()
+    except Exception:
+        queue.put(('ERROR', worker, 'worker %d' % worker,
+            traceback.format_exc(), None, 0))
+    queue.put(('done', worker, '', tests_run, None, 0))
+
+class ParallelExecutor(object):
+    """
+    Runs the tests split across a number of worker processes, reporting
+    the combined results.
+
+    Each worker writes its xml report next to xml_output, and measures
+    coverage for the given coverage stage if there is one. The tests are
+    shared out between workers using the recorded timings, which are
+    updated afterwards unless record_timings is False.
+    """
+
+    def __init__(self, processes=2, failfast=False, nodatabase=False,
+            xml_out=False, xml_output=None, coverage=None, record_timings=True):
+        self.processes = processes
+        self.failfast = failfast
+        self.nodatabase = nodatabase
+        self.xml_out = xml_out
+        self.xml_output = xml_output or DEFAULT_XML_OUTPUT
+        self.coverage = coverage
+        self.record_timings = record_timings
+
+    def execute(self, run, suite):
+        """
+        Returns the number of tests that failed or errored, like the
+        serial runners.
+        """
+        verbosity = run.verbosity
+        coverage_file = self.coverage and self.coverage.data_file
+        chunks = split_tests(flatten_suite(suite), self.processes, load_timings())
+        stream = _WritelnDecorator(sys.stderr)
+        if verbosity >= 1:
+            stream.writeln('Running %d tests in %d processes' %
+                (suite.countTestCases(), len(chunks)))
+
+        close_connections()
+        queue = multiprocessing.Queue()
+        stop_event = multiprocessing.Event()
+        workers = []
+        for worker, tests in enumerate(chunks):
+            process = multiprocessing.Process(target=run_worker,
+                args=(worker + 1, tests, queue, stop_event),
+                kwargs=dict(verbosity=verbosity, nodatabase=self.nodatabase,
+                    xml_out=self.xml_out, xml_output=self.xml_output,
+                    coverage_file=coverage_file))
+            process.start()
+            workers.append(process)
+
+        startTime = time.time()
+        tests_run = 0
+        timings = {}
+        problems = []
+        finished = set()
+        try:
+            while len(finished) < len(workers):
+                try:
+                    outcome, worker, description, details, test_id, seconds = \
+                        queue.get(timeout=1)
+                except Empty:
+                    # Notice workers that died without saying goodbye
+                    for worker, process in enumerate(workers):
+                        worker += 1
+                        if worker not in finished and process.exitcode:
+                            finished.add(worker)
+                            problems.append(('ERROR', 'worker %d' % worker,
+                                'Worker exited with code %d\n' % process.exitcode))
+                    continue
+
+                if outcome == 'done':
+                    finished.add(worker)
+                    tests_run += details
+                    continue
+                if test_id:
+                    failed = outcome in ('ERROR', 'FAIL') or \
+                        timings.get(test_id, (0, False))[1]
+                    timings[test_id] = (seconds, failed)
+                if outcome in ('ERROR', 'FAIL'):
+                    problems.append((outcome, description, details))
+                    if self.failfast:
+                        stop_event.set()
+
+                if verbosity > 1:
+                    stream.writeln('%s ... %s' % (description, outcome))
+                elif verbosity == 1:
+                    stream.write({'ok': '.', 'ERROR': 'E', 'FAIL': 'F',
+                        'skipped': 's', 'expected failure': 'x',
+                        'unexpected success': 'u'}[outcome])
+                    stream.flush()
+        except KeyboardInterrupt:
+            for process in workers:
+                process.terminate()
+            raise
+        for process in workers:
+            process.join()
+        timeTaken = time.time() - startTime
+        if self.record_timings:
+            save_timings(timings)
+
+        if verbosity >= 1:
+            stream.writeln()
+        for outcome, description, details in problems:
+            stream.writeln(separator1)
+            stream.writeln('%s: %s' % (outcome, description))
+            stream.writeln(separator2)
+            stream.writeln(details)
+        stream.writeln(separator2)
+        stream.writeln('Ran %d test%s in %.3fs' %
+            (tests_run, tests_run != 1 and 's' or '', timeTaken))
+        stream.writeln()
+        failed = len([p for p in problems if p[0] == 'FAIL'])
+        errored = len(problems) - failed
+        if problems:
+            counts = []
+            if failed:
+                counts.append('failures=%d' % failed)
+            if errored:
+                counts.append('errors=%d' % errored)
+            stream.writeln('FAILED (%s)' % ', '.join(counts))
+        else:
+            stream.writeln('OK')
+        return len(problems)
+
+def run_tests(test_labels, verbosity=1, interactive=True, extra_tests=[],
+        processes=2, failfast=False, nodatabase=False, xml_out=False,
+        coverage=False, xmlcoverage=False, html_only=False,
+        xml_output=DEFAULT_XML_OUTPUT, data_suffix=None, failed_first=False):
+    """
+    Run the tests for the given labels split across a number of worker
+    processes, reporting the combined results.
+
+    If data_suffix is given the combined coverage data is saved to
+    .coverage.<data_suffix> as well as .coverage, and with failed_first
+    each worker starts with the tests that failed last time.
+    """
+    return make_run(test_labels, verbosity, interactive, extra_tests,
+        processes=processes, failfast=failfast, nodatabase=nodatabase,
+        xml_out=xml_out, xml_output=xml_output, coverage=coverage,
+        xmlcoverage=xmlcoverage, html_only=html_only, data_suffix=data_suffix,
+        failed_first=failed_first).run()
@@ -0,0 +1,321 @@
+"""
+Test runs put together from stages.
+
+A run builds the suite once, then hands it to an executor which runs the
+tests in this process, with or without xml output, or across worker
+processes. Stages hook in around discovery and execution to set up the
+test databases, reorder the tests and measure and report on coverage.
+The test command builds its runs here, so its options can be combined
+freely, and the runner functions in the other modules are thin wrappers
+around make_run.
+"""
+
+import unittest as real_unittest
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import get_app, get_apps
+from django.test.simple import build_test, build_suite, get_tests
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+try:
+    # The django.utils.unittest alias is available in Django >= 1.3
+    from django.utils import unittest
+except ImportError:
+    import unittest
+
+# Django versions prior to 1.2 don't include the DjangoTestSuiteRunner class
+# or multi-database support.
+try:
+    from django.test.simple import DjangoTestSuiteRunner, reorder_suite
+    from django.test import TestCase
+except ImportError:
+    DjangoTestSuiteRunner = None
+
+from timings import TimingResultMixin, save_timings
+
+def find_app_name(app_label):
+    "Returns the name of the installed app with the given label"
+    for app_name in settings.INSTALLED_APPS:
+        if app_name.split('.')[-1] == app_label:
+            return app_name
+    raise ImproperlyConfigured("App with label %s could not be found" % app_label)
+
+def find_app(app_label):
+    """
+    Returns the models module of the installed app with the given label.
+    Unlike get_app this only imports that app's models, rather than every
+    installed app's.
+    """
+    return __import__('%s.models' % find_app_name(app_label), {}, {}, [''])
+
+def get_test_apps(nodatabase=False):
+    """
+    Returns the models modules of the installed apps to test. Without the
+    database Django's own apps are skipped, as their tests use it.
+    """
+    apps = get_apps()
+    if nodatabase:
+        apps = [app for app in apps if not app.__name__.startswith('django')]
+    return apps
+
+def build_app_test(label):
+    """
+    Builds the tests for an app.TestClass or app.TestClass.test_method
+    label as build_test does, but only importing the one app. Anything
+    else, such as a doctest, is left to build_test.
+    """
+    parts = label.split('.')
+    if len(parts) in (2, 3):
+        app_module = find_app(parts[0])
+        test_module = get_tests(app_module)
+        TestClass = getattr(app_module, parts[1], None)
+        if TestClass is None and test_module:
+            TestClass = getattr(test_module, parts[1], None)
+        if isinstance(TestClass, type) and \
+                issubclass(TestClass, (unittest.TestCase, real_unittest.TestCase)):
+            if len(parts) == 2:
+                return unittest.TestLoader().loadTestsFromTestCase(TestClass)
+            return TestClass(parts[2])
+    return build_test(label)
+
+def discover(test_labels, extra_tests=(), lightweight=False):
+    """
+    Builds the suite for the given labels, or for every installed app if
+    there are none. Labels must be of the form:
+     - app.TestClass.test_method
+        Run a single specific test method
+     - app.TestClass
+        Run all the test methods in a given class
+     - app
+        Search for doctests and unittests in the named application.
+
+    Tests named on their own are built from the discovery index where it
+    can, only importing the modules defining them. If lightweight is set
+    only the apps named in the labels are imported, which is enough for
+    tests that don't use the database, and without labels Django's own
+    apps are skipped.
+    """
+    suite = unittest.TestSuite()
+    if test_labels:
+        index = None
+        for label in test_labels:
+            if '.' in label:
+                if index is None:
+                    from discovery import DiscoveryIndex
+                    index = DiscoveryIndex()
+                tests = index.build_test(label)
+                if tests is not None:
+                    suite.addTest(tests)
+                elif lightweight:
+                    suite.addTest(build_app_test(label))
+                else:
+                    suite.addTest(build_test(label))
+            elif lightweight:
+                suite.addTest(build_suite(find_app(label)))
+            else:
+                suite.addTest(build_suite(get_app(label)))
+        if index is not None:
+            index.save()
+    else:
+        for app in get_test_apps(nodatabase=lightweight):
+            suite.addTest(build_suite(app))
+
+    for test in extra_tests:
+        suite.addTest(test)
+    return suite
+
+def flatten_suite(suite):
+    "Returns the individual test cases from a (possibly nested) suite"
+    tests = []
+    for test in suite:
+        if hasattr(test, '__iter__'):
+            tests.extend(flatten_suite(test))
+        else:
+            tests.append(test)
+    return tests
+
+class Stage(object):
+    """
+    Hooks into a test run. after_tests is called in reverse order, and
+    only for stages whose before_tests was called.
+    """
+
+    def before_discovery(self, run):
+        pass
+
+    def after_discovery(self, run, suite):
+        "Returns the suite to run, which may be a new one"
+        return suite
+
+    def before_tests(self, run):
+        pass
+
+    def after_tests(self, run):
+        pass
+
+    def report(self, run):
+        pass
+
+class TestDatabases(Stage):
+    "Creates the test databases before the tests and destroys them after"
+
+    def before_tests(self, run):
+        if DjangoTestSuiteRunner is not None:
+            self.runner = DjangoTestSuiteRunner(run.verbosity, run.interactive)
+            self.old_config = self.runner.setup_databases()
+        else:
+            from django.db import connection
+            self.old_name = settings.DATABASE_NAME
+            connection.creation.create_test_db(run.verbosity,
+                autoclobber=not run.interactive)
+
+    def after_tests(self, run):
+        if DjangoTestSuiteRunner is not None:
+            self.runner.teardown_databases(self.old_config)
+        else:
+            from django.db import connection
+            connection.creation.destroy_test_db(self.old_name, run.verbosity)
+
+class FailedFirst(Stage):
+    "Moves the tests which failed last time to the front of the suite"
+
+    def after_discovery(self, run, suite):
+        from timings import order_failed_first
+        return unittest.TestSuite(order_failed_first(flatten_suite(suite)))
+
+try:
+    TextTestResult = unittest.TextTestResult
+except AttributeError:  # unittest before Python 2.7
+    TextTestResult = unittest._TextTestResult
+
+class TimedTextTestResult(TimingResultMixin, TextTestResult):
+    pass
+
+class TimedTextTestRunner(unittest.TextTestRunner):
+    "Text test runner whose result records how long each test took"
+
+    def _makeResult(self):
+        return TimedTextTestResult(self.stream, self.descriptions, self.verbosity)
+
+class TextExecutor(object):
+    """
+    Runs the tests in this process, printing the results as they go, and
+    updates the timing file unless record_timings is False
+    """
+
+    def __init__(self, failfast=False, record_timings=True):
+        self.failfast = failfast
+        self.record_timings = record_timings
+
+    def execute(self, run, suite):
+        "Runs the suite, returning the number of tests that failed"
+        try:
+            runner = TimedTextTestRunner(verbosity=run.verbosity,
+                failfast=self.failfast)
+        except TypeError:  # unittest before Python 2.7 has no failfast
+            runner = TimedTextTestRunner(verbosity=run.verbosity)
+        result = runner.run(suite)
+        if self.record_timings:
+            save_timings(result.timings)
+        return len(result.failures) + len(result.errors)
+
+class TestRun(object):
+    """
+    Discovers the tests for the given labels and runs them with the
+    executor, calling the stages' hooks along the way. Runs without the
+    database discover their tests without importing every app.
+    """
+
+    def __init__(self, test_labels, executor, stages=(), verbosity=1,
+            interactive=True, extra_tests=(), nodatabase=False):
+        self.test_labels = test_labels
+        self.executor = executor
+        self.stages = list(stages)
+        self.verbosity = verbosity
+        self.interactive = interactive
+        self.extra_tests = extra_tests
+        self.nodatabase = nodatabase
+
+    def run(self):
+        "Returns the number of tests that failed"
+        setup_test_environment()
+        settings.DEBUG = False
+        try:
+            for stage in self.stages:
+                stage.before_discovery(self)
+            suite = discover(self.test_labels, self.extra_tests,
+                lightweight=self.nodatabase)
+            if DjangoTestSuiteRunner is not None:
+                # Database tests first, as Django's own runner does
+                suite = reorder_suite(suite, (TestCase,))
+            for stage in self.stages:
+                suite = stage.after_discovery(self, suite)
+
+            started = []
+            try:
+                for stage in self.stages:
+                    stage.before_tests(self)
+                    started.append(stage)
+                failures = self.executor.execute(self, suite)
+            finally:
+                for stage in reversed(started):
+                    stage.after_tests(self)
+
+            for stage in self.stages:
+                stage.report(self)
+        finally:
+            teardown_test_environment()
+        return failures
+
+def make_run(test_labels, verbosity=1, interactive=True, extra_tests=(),
+        failfast=False, nodatabase=False, xml_out=False, xml_output=None,
+        coverage=False, xmlcoverage=False, html_only=False, data_suffix=None,
+        figleaf=False, processes=0, failed_first=False, profile_tests=None,
+        record_timings=True):
+    """
+    Puts together a test run from the test command's options. Any of them
+    can be combined, apart from figleaf and profile_tests with processes.
+    Unless record_timings is False the timing file is updated.
+    """
+    stages = []
+    coverage_stage = None
+    if coverage or xmlcoverage:
+        from codecoverage import CoverageStage
+        coverage_stage = CoverageStage(xml_out=xmlcoverage, html_only=html_only,
+            data_suffix=data_suffix, in_process=not processes)
+        stages.append(coverage_stage)
+    if figleaf:
+        from figleafcoverage import FigleafStage
+        stages.append(FigleafStage())
+    if failed_first:
+        stages.append(FailedFirst())
+
+    if processes:
+        from parallel import ParallelExecutor
+        # Every worker sets up its own databases
+        executor = ParallelExecutor(processes, failfast=failfast,
+            nodatabase=nodatabase, xml_out=xml_out, xml_output=xml_output,
+            coverage=coverage_stage, record_timings=record_timings)
+    else:
+        if not nodatabase:
+            # First, so the other stages' before_tests and after_tests run
+            # once the databases are there, and see them as a phase of their own
+            stages.insert(0, TestDatabases())
+        if xml_out:
+            from xmloutput import XMLExecutor
+            executor = XMLExecutor(xml_output, profile_tests, record_timings)
+        else:
+            executor = TextExecutor(failfast, record_timings)
+
+    return TestRun(test_labels, executor, stages, verbosity, interactive,
+        extra_tests, nodatabase)
+
+def run_tests(test_labels, verbosity=1, interactive=True, extra_tests=[],
+        **options):
+    """
+    Test runner taking any of make_run's options. Returns the number of
+    tests that failed.
+    """
+    return make_run(test_labels, verbosity, interactive, extra_tests,
+        **options).run()
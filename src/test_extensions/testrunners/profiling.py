@@ -0,0 +1,276 @@
+"""
+Profilers for test runs.
+
+SamplingProfiler profiles a whole run cheaply. Rather than tracing every
+call, a CPU time interval timer interrupts the process every few
+milliseconds and the handler records the stack it interrupted. Each
+sample is put down to the test running at the time, found from the
+TestCase.run frame on the stack, so the cost stays at a few percent
+however many calls the tests make. The samples are written out in the
+collapsed stack format read by flamegraph.pl and speedscope, one line per
+distinct stack with the test id as its outermost frame, followed by the
+number of samples.
+
+TestProfiler runs each test's setUp, test method and tearDown under
+cProfile, saving a .pstats file for each test and adding up the hotspots
+of each phase across the run.
+"""
+
+import os
+import re
+import sys
+import signal
+import pstats
+import unittest
+try:
+    import cProfile as profile
+except ImportError:  # Python < 2.5
+    import profile
+
+from django.conf import settings
+
+DEFAULT_INTERVAL = 0.005
+DEFAULT_PROFILE_FILE = 'profile.collapsed'
+DEFAULT_PROFILE_DIRECTORY = 'temp/profiles'
+
+# Stands in for the test id in samples taken outside of any test
+OUTSIDE_TESTS = '(outside tests)'
+
+def _run_codes():
+    "Returns the code objects of the TestCase.run methods in use"
+    classes = [unittest.TestCase]
+    try:
+        from django.utils import unittest as django_unittest
+        classes.append(django_unittest.TestCase)
+    except ImportError:  # Django < 1.3
+        pass
+    return set([cls.run.im_func.func_code for cls in classes])
+
+def short_file_name(file_name):
+    "Returns a file name relative to the sys.path entry it was imported from"
+    best = ''
+    for path in sys.path:
+        path = os.path.join(os.path.abspath(path or os.curdir), '')
+        if file_name.startswith(path) and len(path) > len(best):
+            best = path
+    return file_name[len(best):]
+
+def frame_name(code):
+    "Describes a function in a collapsed stack"
+    return '%s (%s:%d)' % (code.co_name, short_file_name(code.co_filename),
+        code.co_firstlineno)
+
+class SamplingProfiler(object):
+    """
+    Samples the stack every interval seconds of CPU time between start()
+    and stop(). Needs signal.setitimer, so is only available on Unix.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.samples = {}
+        self.run_codes = _run_codes()
+        self.previous_handler = None
+
+    def start(self):
+        self.previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        # Restart system calls the timer interrupts rather than failing them
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.previous_handler or signal.SIG_DFL)
+
+    def _sample(self, signum, frame):
+        codes = []
+        test_id = OUTSIDE_TESTS
+        run_codes = self.run_codes
+        while frame is not None:
+            code = frame.f_code
+            if code in run_codes:
+                test = frame.f_locals.get('self')
+                if test is not None:
+                    test_id = test.id()
+                    break
+            codes.append(code)
+            frame = frame.f_back
+        key = (test_id, tuple(codes))
+        self.samples[key] = self.samples.get(key, 0) + 1
+
+    def total(self):
+        return sum(self.samples.values())
+
+    def stacks(self):
+        """
+        Yields each distinct stack sampled as a list of frame names,
+        outermost first and starting with the test id, with its count.
+        """
+        names = {}
+        for (test_id, codes), count in self.samples.iteritems():
+            stack = [test_id]
+            for code in reversed(codes):
+                if code not in names:
+                    names[code] = frame_name(code)
+                stack.append(names[code])
+            yield stack, count
+
+    def write_collapsed(self, file_name):
+        directory = os.path.dirname(file_name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        output = open(file_name, 'w')
+        try:
+            for stack, count in sorted(self.stacks()):
+                output.write('%s %d\n' % (';'.join(stack), count))
+        finally:
+            output.close()
+
+    def test_totals(self):
+        "Returns a dictionary of test id to number of samples"
+        totals = {}
+        for (test_id, codes), count in self.samples.iteritems():
+            totals[test_id] = totals.get(test_id, 0) + count
+        return totals
+
+    def function_totals(self):
+        """
+        Returns dictionaries of function name to the number of samples
+        taken in the function itself, and to the number taken in it or in
+        anything it called.
+        """
+        own = {}
+        inclusive = {}
+        for stack, count in self.stacks():
+            functions = stack[1:]
+            if functions:
+                own[functions[-1]] = own.get(functions[-1], 0) + count
+            for name in set(functions):
+                inclusive[name] = inclusive.get(name, 0) + count
+        return own, inclusive
+
+def get_profile_file():
+    """
+    Returns the file to write the collapsed stacks to, next to the coverage
+    HTML report if there is one.
+    """
+    file_name = getattr(settings, 'TEST_PROFILE_FILE', None)
+    if file_name:
+        return file_name
+    from htmlcoverage import get_html_directory
+    return os.path.join(get_html_directory() or 'temp', DEFAULT_PROFILE_FILE)
+
+def report_profile(profiler, file_name=None, limit=10, stream=sys.stdout):
+    "Writes out the collapsed stacks and prints the busiest tests and functions"
+    file_name = file_name or get_profile_file()
+    profiler.write_collapsed(file_name)
+
+    total = profiler.total()
+    print >>stream
+    print >>stream, 'Profile of %d samples, %.0fms apart, was output to %r' % (
+        total, profiler.interval * 1000, file_name)
+    if not total:
+        return
+
+    def print_table(title, totals):
+        print >>stream
+        print >>stream, title
+        busiest = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+        for name, count in busiest[:limit]:
+            print >>stream, '%6.1f%% %s' % (100.0 * count / total, name)
+
+    own, inclusive = profiler.function_totals()
+    print_table('Busiest tests:', profiler.test_totals())
+    print_table('Busiest functions, by own samples:', own)
+    print_table('Busiest functions, including their callees:', inclusive)
+
+def get_profile_directory():
+    return getattr(settings, 'TEST_PROFILE_DIRECTORY', DEFAULT_PROFILE_DIRECTORY)
+
+def function_name(function):
+    "Describes a function from a profile as frame_name does"
+    file_name, line, name = function
+    if line:
+        return '%s (%s:%d)' % (name, short_file_name(file_name), line)
+    return name
+
+class TestProfiler(object):
+    """
+    Profiles tests one at a time, between calls to start() and stop() from
+    a test result. The profile of each test which took at least threshold
+    seconds is saved to directory as <test id>.pstats, and added to the
+    totals for each phase.
+    """
+
+    PHASES = ('setUp', 'test', 'tearDown')
+
+    def __init__(self, directory=None, threshold=0.0):
+        self.directory = directory or get_profile_directory()
+        self.threshold = threshold
+        # Phase -> pstats.Stats for all of the tests profiled
+        self.totals = {}
+        self.profiled = 0
+        self.profiles = {}
+        self.wrapped = []
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # Don't leave profiles from earlier runs lying around
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.pstats'):
+                os.remove(os.path.join(self.directory, file_name))
+
+    def _profiled(self, phase, method):
+        def profiled(*args, **kwargs):
+            if phase not in self.profiles:
+                self.profiles[phase] = profile.Profile()
+            return self.profiles[phase].runcall(method, *args, **kwargs)
+        return profiled
+
+    def start(self, test):
+        "Wraps the test's methods so each phase is profiled on its own"
+        self.profiles = {}
+        self.wrapped = []
+        method_names = ('setUp', getattr(test, '_testMethodName', None),
+            'tearDown')
+        for phase, name in zip(self.PHASES, method_names):
+            method = name and getattr(test, name, None)
+            if method is not None:
+                setattr(test, name, self._profiled(phase, method))
+                self.wrapped.append(name)
+
+    def stop(self, test, seconds):
+        for name in self.wrapped:
+            test.__dict__.pop(name, None)
+        profiles = [(phase, self.profiles[phase]) for phase in self.PHASES
+            if phase in self.profiles]
+        self.profiles = {}
+        if not profiles or seconds < self.threshold:
+            return
+
+        for phase, phase_profile in profiles:
+            if phase in self.totals:
+                self.totals[phase].add(phase_profile)
+            else:
+                self.totals[phase] = pstats.Stats(phase_profile)
+        stats = pstats.Stats(*[phase_profile for phase, phase_profile in profiles])
+        file_name = re.sub(r'[^\w.-]', '_', test.id()) + '.pstats'
+        stats.dump_stats(os.path.join(self.directory, file_name))
+        self.profiled += 1
+
+    def report(self, limit=10, stream=sys.stdout):
+        "Prints the functions which took the most time in each phase"
+        print >>stream
+        print >>stream, 'Profiles of %d tests were output to %r' % (
+            self.profiled, self.directory)
+        for phase in self.PHASES:
+            if phase not in self.totals:
+                continue
+            stats = self.totals[phase]
+            print >>stream
+            print >>stream, '%s, %.3fs in total:' % (phase, stats.total_tt)
+            print >>stream, '   own s   cumul s     calls  function'
+            busiest = sorted(stats.stats.items(), key=lambda item: -item[1][2])
+            for function, (primitive_calls, calls, own, cumulative, callers) \
+                    in busiest[:limit]:
+                print >>stream, '%8.3f %9.3f %9d  %s' % (own, cumulative,
+                    calls, function_name(function))
@@ -0,0 +1,89 @@
+"""
+Splits the tests the runners would build into deterministic shards, so
+one suite can be spread across several machines with --shard K/N.
+
+Every node lists the full set of tests and works out the same split,
+then runs its own share by handing the runner a label per test. The
+tests are listed from the discovery index, so only the apps which have
+changed since it was written are imported to do so.
+
+The split is only balanced using timings from a file named explicitly,
+which every node must have a copy of, never from the local timing file
+that runs on one node may have changed.
+"""
+
+import os
+import hashlib
+
+from discovery import collect_tests
+from timings import load_timings
+
+def parse_shard(value):
+    """
+    Parses a shard given as K/N, returning the tuple (K, N). Shards are
+    numbered from 1.
+    """
+    try:
+        shard, shards = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise ValueError("Shard '%s' should be of the form K/N" % value)
+    if not 1 <= shard <= shards:
+        raise ValueError("Shard '%s' should satisfy 1 <= K <= N" % value)
+    return shard, shards
+
+def shard_suffix(shard, shards):
+    return 'shard%dof%d' % (shard, shards)
+
+def shard_file_name(file_name, shard, shards):
+    "Returns the name of a shard's copy of an output file"
+    root, ext = os.path.splitext(file_name)
+    return '%s_%s%s' % (root, shard_suffix(shard, shards), ext)
+
+def stable_hash(label):
+    "A hash of the label which is the same on every machine and run"
+    return int(hashlib.md5(label).hexdigest(), 16)
+
+def select_shard(collected, shard, shards, timings=None):
+    """
+    Returns the labels making up the given shard, in their original order.
+
+    With timings, labels are handed out longest first to the shard with
+    the least total time so far, tests with no recorded time counting as
+    the average. Without timings each label goes to the shard picked by a
+    stable hash of the label.
+    """
+    if not timings:
+        return [label for label, test_ids in collected
+            if stable_hash(label) % shards == shard - 1]
+
+    known = [timings[test_id] for label, test_ids in collected
+        for test_id in test_ids if test_id in timings]
+    default = known and sum(known) / len(known) or 1.0
+
+    weighted = []
+    for label, test_ids in collected:
+        weight = sum([timings.get(test_id, default) for test_id in test_ids])
+        weighted.append((-weight, label))
+    weighted.sort()
+
+    totals = [(0.0, 0, index) for index in range(shards)]
+    selected = set()
+    for weight, label in weighted:
+        total, count, index = min(totals)
+        totals[index] = (total - weight, count + 1, index)
+        if index == shard - 1:
+            selected.add(label)
+    return [label for label, test_ids in collected if label in selected]
+
+def get_shard_labels(test_labels, shard, shards, timings_file=None):
+    """
+    Returns the labels to hand to the runner to run one shard of the
+    tests for the given labels, balanced using the timings in timings_file
+    if it is given.
+    """
+    timings = None
+    if timings_file:
+        if not os.path.exists(timings_file):
+            raise ValueError("Shard timing file '%s' does not exist" % timings_file)
+        timings = load_timings(timings_file)
+    return select_shard(collect_tests(test_labels), shard, shards, timings)
@@ -0,0 +1,115 @@
+"""
+Per-test durations and outcomes kept between runs.
+
+They are used to balance work between shards and worker processes, to
+run the tests that failed last time first and to report on the slowest
+tests. The timing file is a JSON object mapping test ids, as returned by
+``test.id()``, to a ``[seconds, failed]`` pair from the last time the
+test ran.
+"""
+
+import os
+import time
+
+try:
+    import json
+except ImportError:  # Python < 2.6
+    from django.utils import simplejson as json
+
+from django.conf import settings
+from django.test import TestCase
+
+DEFAULT_TIMINGS_FILE = 'temp/test_timings.json'
+
+def get_timings_file():
+    return getattr(settings, 'TEST_TIMINGS_FILE', DEFAULT_TIMINGS_FILE)
+
+def _read(file_name=None):
+    file_name = file_name or get_timings_file()
+    if not os.path.exists(file_name):
+        return {}
+    timing_file = open(file_name)
+    try:
+        return json.load(timing_file)
+    finally:
+        timing_file.close()
+
+def load_timings(file_name=None):
+    """
+    Returns a dictionary of test id to duration in seconds, which is empty
+    if there is no timing file yet.
+    """
+    return dict([(test_id, entry[0]) for test_id, entry in _read(file_name).items()])
+
+def load_failures(file_name=None):
+    "Returns the set of ids of the tests which failed the last time they ran"
+    return set([test_id for test_id, entry in _read(file_name).items() if entry[1]])
+
+def save_timings(results, file_name=None):
+    """
+    Merges a dictionary of test id to (seconds, failed) from this run into
+    the timing file.
+    """
+    if not results:
+        return
+    file_name = file_name or get_timings_file()
+    store = _read(file_name)
+    for test_id, (seconds, failed) in results.items():
+        store[test_id] = [round(seconds, 3), int(bool(failed))]
+
+    directory = os.path.dirname(file_name)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    # Write to a temporary file first so an interrupted run can't leave a
+    # half written timing file behind
+    temp_name = '%s.%d' % (file_name, os.getpid())
+    timing_file = open(temp_name, 'w')
+    try:
+        try:
+            json.dump(store, timing_file, separators=(',', ':'))
+        finally:
+            timing_file.close()
+    except:
+        os.remove(temp_name)
+        raise
+    os.rename(temp_name, file_name)
+
+class TimingResultMixin(object):
+    """
+    Test result mixin which records how long each test took, and whether it
+    failed, in timings: a dictionary of test id to (seconds, failed) ready
+    for save_timings.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TimingResultMixin, self).__init__(*args, **kwargs)
+        self.timings = {}
+
+    def startTest(self, test):
+        self._timingStart = time.time()
+        self._timingProblems = len(self.failures) + len(self.errors)
+        super(TimingResultMixin, self).startTest(test)
+
+    def stopTest(self, test):
+        self.timings[test.id()] = (time.time() - self._timingStart,
+            len(self.failures) + len(self.errors) > self._timingProblems)
+        super(TimingResultMixin, self).stopTest(test)
+
+def order_failed_first(tests, failures=None):
+    """
+    Returns the tests with those that failed last time moved to the front,
+    otherwise keeping their order. Django TestCases still run before other
+    tests, as the Django runner arranges.
+    """
+    if failures is None:
+        failures = load_failures()
+
+    def key(test):
+        return (not isinstance(test, TestCase), test.id() not in failures)
+    return sorted(tests, key=key)
+
+def slowest_tests(count, file_name=None):
+    "Returns the given number of slowest tests as (seconds, test id) pairs"
+    timings = [(seconds, test_id) for test_id, seconds in load_timings(file_name).items()]
+    timings.sort(reverse=True)
+    return timings[:count]
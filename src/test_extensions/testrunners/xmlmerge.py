@@ -0,0 +1,164 @@
+"""
+Merges the xml reports written by several shards or worker processes
+into a single report.
+
+The reports are read a chunk at a time with expat, and each element
+directly below a report's testsuite element is copied through to the
+merged report byte for byte as soon as it ends, without being rebuilt
+and serialized again. Memory use stays flat however many reports there
+are and however large they get.
+"""
+
+import os
+import re
+import tempfile
+from xml.parsers import expat
+from xml.sax.saxutils import quoteattr
+
+# Totals on the testsuite element which are added up across reports
+TOTALS = ('errors', 'failures', 'skipped', 'tests')
+
+# A start tag, allowing for '>' in its attribute values
+_START_TAG = re.compile(r'<[^>"\']*(?:(?:"[^"]*"|\'[^\']*\')[^>"\']*)*>')
+
+def read_totals(file_name):
+    "Returns the attributes of a report's testsuite element"
+    found = []
+    parser = expat.ParserCreate()
+    def start(name, attributes):
+        found.append(attributes)
+        raise StopIteration
+    parser.StartElementHandler = start
+    report = open(file_name, 'rb')
+    try:
+        while not found:
+            chunk = report.read(4096)
+            try:
+                parser.Parse(chunk, not chunk)
+            except StopIteration:
+                break
+            if not chunk:
+                break
+    finally:
+        report.close()
+    return found and found[0] or {}
+
+def merge_totals(file_names):
+    "Adds up the totals of the given reports"
+    totals = {'time': 0.0}
+    for file_name in file_names:
+        attributes = read_totals(file_name)
+        for name in TOTALS:
+            if name in attributes:
+                totals[name] = totals.get(name, 0) + int(attributes[name])
+        totals['time'] += float(attributes.get('time', 0))
+    return totals
+
+class ReportCopier(object):
+    """
+    Copies the test cases from reports to the output file, and the
+    contents of their suite level system-out and system-err elements to
+    the given files.
+    """
+
+    def __init__(self, output, captured):
+        self.output = output
+        self.captured = captured
+
+    def copy(self, file_name):
+        self.parser = expat.ParserCreate()
+        # Element names have to be byte strings to look for in the data
+        self.parser.returns_unicode = False
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.depth = 0
+        # The unwritten part of the report, from the offset given
+        self.data = ''
+        self.offset = 0
+        self.element_start = None
+
+        report = open(file_name, 'rb')
+        try:
+            while True:
+                chunk = report.read(65536)
+                self.data += chunk
+                self.parser.Parse(chunk, not chunk)
+                if not chunk:
+                    break
+                if self.element_start is not None:
+                    keep = self.element_start - self.offset
+                else:
+                    # Only keep a tag expat might not have finished with
+                    keep = max(self.data.rfind('<'), 0)
+                self.data = self.data[keep:]
+                self.offset += keep
+        finally:
+            report.close()
+
+    def start(self, name, attributes):
+        if self.depth == 1:
+            self.element_start = self.parser.CurrentByteIndex
+        self.depth += 1
+
+    def end(self, name):
+        self.depth -= 1
+        if self.depth != 1:
+            return
+        start = self.element_start - self.offset
+        end = self.parser.CurrentByteIndex - self.offset
+        # The end index is at the end tag, or just past an empty element
+        empty = not self.data.startswith('</' + name, end)
+        if name in self.captured:
+            if not empty:
+                content_start = _START_TAG.match(self.data, start).end()
+                self.captured[name].write(self.data[content_start:end])
+        else:
+            if not empty:
+                end = self.data.index('>', end) + 1
+            self.output.write(self.data[start:end])
+        self.element_start = None
+
+def merge_reports(file_names, output_file, name=''):
+    """
+    Writes a report to output_file containing every test case from the
+    reports in file_names, with their totals added up. Output which was
+    captured outside of any test is gathered into the merged report's
+    own system-out and system-err elements.
+    """
+    totals = merge_totals(file_names)
+
+    directory = os.path.dirname(output_file)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    output = open(output_file, 'wb')
+    # Suite level output is held in temporary files until the end
+    captured = {'system-out': tempfile.TemporaryFile(),
+        'system-err': tempfile.TemporaryFile()}
+    try:
+        attributes = ['errors="%i"' % totals.get('errors', 0),
+            'failures="%i"' % totals.get('failures', 0),
+            'name=%s' % quoteattr(name)]
+        if 'skipped' in totals:
+            attributes.append('skipped="%i"' % totals['skipped'])
+        attributes.extend(['tests="%i"' % totals.get('tests', 0),
+            'time="%.3f"' % totals['time']])
+        output.write('<testsuite %s>' % ' '.join(attributes))
+
+        copier = ReportCopier(output, captured)
+        for file_name in file_names:
+            copier.copy(file_name)
+
+        for tag in ('system-out', 'system-err'):
+            output.write('<%s>' % tag)
+            captured[tag].seek(0)
+            while True:
+                chunk = captured[tag].read(65536)
+                if not chunk:
+                    break
+                output.write(chunk)
+            output.write('</%s>' % tag)
+        output.write('</testsuite>')
+    finally:
+        output.close()
+        for temp_file in captured.values():
+            temp_file.close()
@@ -1,9 +1,12 @@
-import time, traceback, string
+import re, time
 
 from xmlunit.unittest import _WritelnDecorator, XmlTextTestRunner as his_XmlTextTestRunner
 
+from django.conf import settings
 from django.test.simple import *
-from xml.sax.saxutils import escape
+
+from timings import save_timings, order_failed_first, TimingResultMixin
+from pipeline import make_run, flatten_suite
 
 try:
     # The django.utils.unittest alias is available in Django >= 1.3
@@ -11,64 +14,110 @@ try:
 except ImportError:
     import unittest
 
+DEFAULT_XML_OUTPUT = 'temp/xml/test_output.xml'
+
 try:
     class XMLTestSuiteRunner(DjangoTestSuiteRunner):
+        def __init__(self, verbosity=1, interactive=True, failfast=True,
+                xml_output=DEFAULT_XML_OUTPUT, failed_first=False,
+                profile_tests=None, **kwargs):
+            super(XMLTestSuiteRunner, self).__init__(verbosity, interactive,
+                failfast, **kwargs)
+            self.xml_output = xml_output
+            self.failed_first = failed_first
+            self.profile_tests = profile_tests
+
+        def build_suite(self, *args, **kwargs):
+            suite = super(XMLTestSuiteRunner, self).build_suite(*args, **kwargs)
+            if self.failed_first:
+                suite = unittest.TestSuite(order_failed_first(flatten_suite(suite)))
+            return suite
+
         def run_suite(self, suite, **kwargs):
-            return XMLTestRunner(verbosity=self.verbosity).run(suite)
+            return XMLTestRunner(verbosity=self.verbosity,
+                outputFileName=self.xml_output,
+                profiler=make_profiler(self.profile_tests)).run(suite)
 except NameError:  # DjangoTestSuiteRunner is not available in Django < 1.2
     pass
 
-def run_tests(test_labels, verbosity=1, interactive=True, extra_tests=[]):
-    setup_test_environment()
-
-    settings.DEBUG = False
-    suite = unittest.TestSuite()
-
-    if test_labels:
-        for label in test_labels:
-            if '.' in label:
-                suite.addTest(build_test(label))
-            else:
-                app = get_app(label)
-                suite.addTest(build_suite(app))
-    else:
-        for app in get_apps():
-            suite.addTest(build_suite(app))
-
-    for test in extra_tests:
-        suite.addTest(test)
-
-    old_name = settings.DATABASE_NAME
-    from django.db import connection
-    connection.creation.create_test_db(verbosity, autoclobber=not interactive)
-    result = XMLTestRunner(verbosity=verbosity).run(suite)
-    connection.creation.destroy_test_db(old_name, verbosity)
-
-    teardown_test_environment()
+def run_tests(test_labels, verbosity=1, interactive=True, extra_tests=[],
+        xml_output=DEFAULT_XML_OUTPUT, failed_first=False, profile_tests=None):
+    return make_run(test_labels, verbosity, interactive, extra_tests,
+        xml_out=True, xml_output=xml_output, failed_first=failed_first,
+        profile_tests=profile_tests).run()
+
+class XMLExecutor(object):
+    "Runs the tests in this process, writing the results to an xml report"
+
+    def __init__(self, xml_output=None, profile_tests=None, record_timings=True):
+        self.xml_output = xml_output or DEFAULT_XML_OUTPUT
+        self.profile_tests = profile_tests
+        self.record_timings = record_timings
+
+    def execute(self, run, suite):
+        runner = XMLTestRunner(verbosity=run.verbosity,
+            outputFileName=self.xml_output,
+            profiler=make_profiler(self.profile_tests))
+        runner.record_timings = self.record_timings
+        result = runner.run(suite)
+        return len(result.failures) + len(result.errors)
+
+def make_profiler(profile_tests):
+    """
+    Returns a profiler for the tests which take at least profile_tests
+    seconds, or None if it is None.
+    """
+    if profile_tests is None:
+        return None
+    from profiling import TestProfiler
+    return TestProfiler(threshold=profile_tests)
 
-    return len(result.failures) + len(result.errors)
+class XMLTestRunner(his_XmlTextTestRunner):
+    # Whether to merge the time taken by each test into the timing file
+    record_timings = True
 
+    def __init__(self, profiler=None, **kwargs):
+        kwargs.setdefault('outputLimit',
+            getattr(settings, 'TEST_OUTPUT_LIMIT', 65536))
+        his_XmlTextTestRunner.__init__(self, **kwargs)
+        self.profiler = profiler
 
-class XMLTestRunner(his_XmlTextTestRunner):
     def _makeResult(self):
-        return _XmlTextTestResult(self.testResults, self.descriptions, self.verbosity)
-
-class _XmlTextTestResult(unittest.TestResult):
+        return _XmlTextTestResult(self.testResults, self.descriptions,
+            self.verbosity, self._captured(), self.profiler)
+
+    def run(self, test):
+        result = his_XmlTextTestRunner.run(self, test)
+        if self.record_timings:
+            save_timings(result.timings)
+        if self.profiler:
+            self.profiler.report()
+        return result
+
+class _XmlTextTestResult(TimingResultMixin, unittest.TestResult):
     """A test result class that can print xml formatted text results to a stream.
 
     Used by XmlTextTestRunner.
     """
     #separator1 = '=' * 70
     #separator2 = '-' * 70
-    def __init__(self, stream, descriptions, verbosity):
+    def __init__(self, stream, descriptions, verbosity, captured=(),
+            profiler=None):
         unittest.TestResult.__init__(self)
         self.stream = _WritelnDecorator(stream)
         self.showAll = verbosity > 1
         self.descriptions = descriptions
         self._lastWas = 'success'
-        self._errorsAndFailures = ""
+        # The error or failure element for the current test, if any
+        self._errorsAndFailures = []
         self._startTime = 0.0
         self.params=""
+        # test id -> (seconds, failed) for every test run
+        self.timings = {}
+        # (element name, captured output) pairs written for each test
+        self.captured = captured
+        # Profiles each test if given, see profiling.TestProfiler
+        self.profiler = profiler
 
     def getDescription(self, test):
         if self.descriptions:
@@ -78,29 +127,36 @@ class _XmlTextTestResult(unittest.TestResult):
 
     def startTest(self, test):  #  CONSIDER  why are there 2 startTests in here?
         self._startTime = time.time()
+        # Skips and the like don't report anything, so start from a success
+        self._lastWas = 'success'
+        # Output from between the tests goes with the suite
+        for tag, output in self.captured:
+            output.setAside()
         test._extraXML = ''
         test._extraAssertions = []
-        unittest.TestResult.startTest(self, test)
-        self.stream.write('<testcase classname="%s' % test.__class__.__name__ + '" name="%s' % test.id().split('.')[-1] + '"')
+        super(_XmlTextTestResult, self).startTest(test)
+        self.stream.write('<testcase classname="%s" name="%s"' % (
+            _cleanHTML(test.__class__.__name__), _cleanHTML(test.id().split('.')[-1])))
         desc = test.shortDescription()
 
         if desc:
             desc = _cleanHTML(desc)
             self.stream.write(' desc="%s"' % desc)
 
+        if self.profiler:
+            self.profiler.start(test)
+
     def stopTest(self, test):
         stopTime = time.time()
         deltaTime = stopTime - self._startTime
-        unittest.TestResult.stopTest(self, test)
+        if self.profiler:
+            self.profiler.stop(test, deltaTime)
+        super(_XmlTextTestResult, self).stopTest(test)
         self.stream.write(' time="%.3f"' % deltaTime)
         self.stream.write('>')
         if self._lastWas != 'success':
-            if self._lastWas == 'error':
-                self.stream.write(self._errorsAndFailures)
-            elif self._lastWas == 'failure':
-                self.stream.write(self._errorsAndFailures)
-            else:
-                assert(False)
+            assert self._lastWas in ('error', 'failure')
+            self.stream.write(''.join(self._errorsAndFailures))
 
         seen = {}
 
@@ -109,8 +165,10 @@ class _XmlTextTestResult(unittest.TestResult):
                 self._addAssertion(assertion[:110]) # :110 avoids tl;dr TODO use a lexical truncator
                 seen[assertion] = True
 
+        for tag, output in self.captured:
+            output.writeElement(self.stream, tag)
         self.stream.write('</testcase>')
-        self._errorsAndFailures = ""
+        self._errorsAndFailures = []
 
         if test._extraXML != '':
             self.stream.write(test._extraXML)
@@ -128,22 +186,19 @@ class _XmlTextTestResult(unittest.TestResult):
         if err[0] is KeyboardInterrupt:
             self.shouldStop = 1
         self._lastWas = 'error'
-        self._errorsAndFailures += '<error type="%s">' % err[0].__name__
-        for line in apply(traceback.format_exception, err):
-           for l in line.split("\n")[:-1]:
-              self._errorsAndFailures += escape(l)
-        self._errorsAndFailures += "</error>"
+        # The base class has already formatted the traceback
+        self._addProblem('error', err, self.errors[-1][1])
 
     def addFailure(self, test, err):
         unittest.TestResult.addFailure(self, test, err)
         if err[0] is KeyboardInterrupt:
             self.shouldStop = 1
         self._lastWas = 'failure'
-        self._errorsAndFailures += '<failure type="%s">' % err[0].__name__
-        for line in apply(traceback.format_exception, err):
-           for l in line.split("\n")[:-1]:
-              self._errorsAndFailures += escape(l)
-        self._errorsAndFailures += "</failure>"
+        self._addProblem('failure', err, self.failures[-1][1])
+
+    def _addProblem(self, tag, err, formatted):
+        self._errorsAndFailures.append('<%s type="%s">%s</%s>' % (tag,
+            _cleanHTML(err[0].__name__), _cleanHTML(formatted), tag))
 
     def printErrors(self):
         pass #assert False
@@ -151,7 +206,15 @@ class _XmlTextTestResult(unittest.TestResult):
     def printErrorList(self, flavour, errors):
         assert False
 
+_ENTITIES = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}
+# Besides markup, matches the control characters which XML 1.0 doesn't
+# allow anywhere in a document, even as character references
+_SPECIAL = re.compile(r'[&<>"\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def _replaceSpecial(match):
+    char = match.group()
+    return _ENTITIES.get(char) or '\\x%02x' % ord(char)
+
 def _cleanHTML(whut):
-    return whut.replace('"', '&quot;'). \
-                replace('<', '&lt;').  \
-                replace('>', '&gt;')
+    "Escapes text for an xml attribute or element in a single pass"
+    return _SPECIAL.sub(_replaceSpecial, whut)
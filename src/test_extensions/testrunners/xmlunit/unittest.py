@@ -84,7 +84,9 @@ import sys
 import traceback
 import string
 import os
+import re
 import types
+import collections
 
 ##############################################################################
 # Test framework core
@@ -557,7 +559,7 @@ class _XmlTextTestResult(TestResult):
 
     Used by XmlTextTestRunner.
     """
-    def __init__(self, stream, descriptions, verbosity):
+    def __init__(self, stream, descriptions, verbosity, captured=()):
         TestResult.__init__(self)
         self.stream = _WritelnDecorator(stream)
         self.showAll = verbosity > 1
@@ -565,6 +567,8 @@ class _XmlTextTestResult(TestResult):
         self._lastWas = 'success'
         self._errorsAndFailures = ""
         self._startTime = 0.0
+        # (element name, captured output) pairs written for each test
+        self.captured = captured
 
     def getDescription(self, test):
         if self.descriptions:
@@ -574,6 +578,9 @@ class _XmlTextTestResult(TestResult):
 
     def startTest(self, test):
         self._startTime = time.time()
+        self._lastWas = 'success'
+        for tag, output in self.captured:
+            output.setAside()
         TestResult.startTest(self, test)
         self.stream.write('<testcase classname="%s' % test.__class__ + '" name="%s' % test.id().split('.')[-1] + '"')
 
@@ -582,17 +589,17 @@ class _XmlTextTestResult(TestResult):
         deltaTime = stopTime - self._startTime
         TestResult.stopTest(self, test)
         self.stream.write(' time="%.3f"' % deltaTime)
-        if self._lastWas == 'success':
-            self.stream.write('/>')
-        else:
-            self.stream.write('>')
+        self.stream.write('>')
+        if self._lastWas != 'success':
             if self._lastWas == 'error':
                 self.stream.write(self._errorsAndFailures)
             elif self._lastWas == 'failure':
                 self.stream.write(self._errorsAndFailures)
             else:
                 assert(false)
-            self.stream.write('</testcase>')
+        for tag, output in self.captured:
+            output.writeElement(self.stream, tag)
+        self.stream.write('</testcase>')
         self._errorsAndFailures = ""
 
     def addSuccess(self, test):
@@ -733,109 +740,193 @@ class TextTestRunner:
             self.stream.writeln("OK")
         return result
 
+# Control characters XML 1.0 doesn't allow anywhere in a document
+_invalidChars = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def _cdata(text):
+    "Makes text safe to put in a CDATA section"
+    text = _invalidChars.sub(lambda match: '\\x%02x' % ord(match.group()), text)
+    # Keep the text from ending the section early
+    return text.replace(']]>', ']]]]><![CDATA[>')
+
 class XmlTextTestRunner:
     """A test runner class that displays results in xml form.
 
     The format is compatible with the Ant junit task xml format.
+
+    The report is written to the output file as the tests run, and the
+    stdout and stderr captured while each test runs is put in its testcase
+    element, up to outputLimit bytes of each, so memory use doesn't grow
+    with the size of the suite. If the run is interrupted the report is
+    still finished off with the results so far.
     """
-    
+
+    # Room left at the start of the report for the testsuite element,
+    # which is filled in with the totals once the run is over
+    _headerSize = 256
+
     class _StdOut:
-        def __init__(self,std):
-            self.reset()
+        """
+        Passes output through, keeping up to limit bytes of it for the
+        report. Once over the limit the oldest output is dropped, and a
+        marker saying how much was lost is put in its place. Output from
+        outside of any test is set aside for the suite, in a buffer of
+        the same size.
+        """
+        def __init__(self, std, limit=65536):
             self._std = std
+            self.limit = limit
+            self.outside = None
+            self.reset()
             return
-        
+
         def write(self, string):
-            self._string += string
-            self._std.write(string)
+            if self._std is not None:
+                self._std.write(string)
+            if isinstance(string, unicode):
+                string = string.encode('utf-8')
+            self._chunks.append(string)
+            self._size += len(string)
+            while self._size > self.limit:
+                chunk = self._chunks.popleft()
+                excess = self._size - self.limit
+                if excess < len(chunk):
+                    # Don't split a multibyte character
+                    while excess < len(chunk) and '\x80' <= chunk[excess] <= '\xbf':
+                        excess += 1
+                    self._chunks.appendleft(chunk[excess:])
+                else:
+                    excess = len(chunk)
+                self._size -= excess
+                self._dropped += excess
             return
 
         def read(self):
-            return self._string
-            
+            captured = ''.join(self._chunks)
+            if self._dropped:
+                captured = '[... %d bytes truncated ...]\n' % self._dropped + captured
+            return captured
+
+        def writeElement(self, output, tag):
+            "Writes and clears the captured output as the given element"
+            if not self._size and not self._dropped:
+                return
+            output.write('<%s><![CDATA[%s]]></%s>' % (tag, _cdata(self.read()), tag))
+            self.reset()
+
+        def setAside(self):
+            "Moves the output captured so far, from outside of any test, to the suite's"
+            if not self._size and not self._dropped:
+                return
+            if self.outside is None:
+                self.outside = self.__class__(None, self.limit)
+            self.outside.write(self.read())
+            self.reset()
+
+        def readOutside(self):
+            "Returns the output captured outside of any test"
+            self.setAside()
+            if self.outside is None:
+                return ''
+            return self.outside.read()
+
+        def flush(self):
+            if self._std is not None:
+                self._std.flush()
+
         def reset(self):
-            self._string = ""
+            self._chunks = collections.deque()
+            self._size = 0
+            self._dropped = 0
 
-    class _StringStream:
+    class _FileStream:
+        "Writes the results straight to the report file"
         def __init__(self):
-            self.reset()
+            self.output = None
             return
-        
+
         def write(self, string):
-            self._string += string
+            if isinstance(string, unicode):
+                string = string.encode('utf-8')
+            self.output.write(string)
             return
 
-        def read(self):
-            return self._string
+        def flush(self):
+            self.output.flush()
 
-        def reset(self):
-            self._string = ""
-        
-    def __init__(self, stream=sys.stderr, descriptions=1, verbosity=1):
+    def __init__(self, stream=sys.stderr, descriptions=1, verbosity=1,
+                 outputFileName='temp/xml/test_output.xml', outputLimit=65536):
         self.descriptions = descriptions
         self.verbosity = verbosity
-        self.stdout = self._StdOut(sys.stdout)
+        self.outputFileName = outputFileName
+        self.stdout = self._StdOut(sys.stdout, outputLimit)
         sys.stdout = self.stdout
-        self.stderr = self._StdOut(sys.stderr)
+        self.stderr = self._StdOut(sys.stderr, outputLimit)
         sys.stderr = self.stderr
-        self.testResults = self._StringStream()
+        self.testResults = self._FileStream()
         self.totalTime = 0.0
         self.output = None
 
-    def _openOutputFile(self, fileName):
+    def _openOutputFile(self, fileName=None):
         
-        if not os.path.isdir(os.path.join("temp", "xml")): os.makedirs(os.path.join("temp", "xml"))
+        outputDir = os.path.dirname(self.outputFileName)
+        if outputDir and not os.path.isdir(outputDir): os.makedirs(outputDir)
         
-        self.outputFileName = 'temp/xml/test_output.xml'
-        self.output = open(self.outputFileName,'w')
+        self.output = open(self.outputFileName,'wb')
+        self.output.write(' ' * (self._headerSize + 1))
+        self.testResults.output = self.output
 
     def _makeResult(self):
-        return _XmlTextTestResult(self.testResults, self.descriptions, self.verbosity)
+        return _XmlTextTestResult(self.testResults, self.descriptions,
+            self.verbosity, self._captured())
+
+    def _captured(self):
+        "The captured output for the results to write out for each test"
+        return [('system-out', self.stdout), ('system-err', self.stderr)]
 
     def _resetBuffers(self):
-        self.testResults.reset()
-        
+        for output in (self.stdout, self.stderr):
+            output.reset()
+            output.outside = None
+
+    def _restoreStreams(self):
+        sys.stdout = self.stdout._std
+        sys.stderr = self.stderr._std
+
     def run(self, test):
         "Run the given test case or test suite."
         result = self._makeResult()
-        for t in test._tests:
-            # get the name of the unit test file name (!!!)
-            size = len(sys.argv[0])
-            if sys.argv[0].endswith('.py'):
-                (filePath,fileName) = os.path.split(sys.argv[0])
-                fileName = fileName.split('.')[0]
-            else:
-                fileName = "%s" % string.split("%s" % t._tests[0]._tests[0].__class__,'.')[0]
-            self._openOutputFile(fileName)
-            startTime = time.time()
-            t(result)
-            stopTime = time.time()
-            timeTaken = float(stopTime - startTime)
-            self.totalTime += timeTaken
-        self._writeReport(result,self.totalTime)
-        # ??? this line
-        run = result.testsRun
+        if test.countTestCases():
+            self._openOutputFile()
+        startTime = time.time()
+        try:
+            test(result)
+        finally:
+            self.totalTime += float(time.time() - startTime)
+            self._writeReport(result,self.totalTime)
+            self._restoreStreams()
         return result
 
     def _writeReport(self, result, timeTaken):
         if self.output != None:
-            self.output.write('<testsuite ')
-            self.output.write('errors="%i" ' % len(result.errors))
-            self.output.write('failures="%i" ' % len(result.failures))
-            self.output.write('name="%s" ' % "")
-            self.output.write('tests="%i" ' % result.testsRun)
-            self.output.write('time="%.3f" ' % timeTaken)
-            self.output.write(' >')
-            self.output.write(self.testResults.read())
+            # Anything printed outside of a test goes with the suite
             self.output.write('<system-out>')
             self.output.write(result.params)
             self.output.write('<![CDATA[')
-            self.output.write(self.stdout.read())
+            self.output.write(_cdata(self.stdout.readOutside()))
             self.output.write(']]></system-out>')
             self.output.write('<system-err><![CDATA[')
-            self.output.write(self.stderr.read())
+            self.output.write(_cdata(self.stderr.readOutside()))
             self.output.write(']]></system-err>')
             self.output.write('</testsuite>')
+            # Now the totals are known fill in the space left for them
+            self.output.seek(0)
+            header = 'errors="%i" ' % len(result.errors) + \
+                'failures="%i" ' % len(result.failures) + \
+                'name="%s" ' % "" + \
+                'tests="%i" ' % result.testsRun + \
+                'time="%.3f" ' % timeTaken
+            self.output.write('<testsuite ' + header.ljust(self._headerSize - 11) + '>')
             self.output.close()
             self._resetBuffers()
             # Write console report
@@ -0,0 +1,147 @@
+"""
+Watches the project's source for changes, for the runtester command.
+
+If pyinotify is installed changes are picked up from inotify events as
+soon as a file is saved, waiting for a short debounce window so that a
+save touching several files only triggers one run. Otherwise the module
+files are polled for a change in modification time once a second.
+
+Only the project's own source is watched: the current directory and the
+installed apps below it, or the directories listed in the
+RUNTESTER_WATCH_DIRS setting.
+"""
+
+import os
+import sys
+import time
+
+from django.conf import settings
+from django.utils.importlib import import_module
+
+from test_extensions import _error_files
+
+def get_watch_dirs():
+    "Returns the directories to watch, including all their subdirectories"
+    dirs = getattr(settings, 'RUNTESTER_WATCH_DIRS', None)
+    if dirs:
+        return [os.path.abspath(path) for path in dirs]
+
+    root = os.getcwd()
+    dirs = []
+    for app in settings.INSTALLED_APPS:
+        try:
+            path = os.path.dirname(os.path.abspath(import_module(app).__file__))
+        except ImportError:
+            continue
+        if path.startswith(root + os.sep):
+            dirs.append(path)
+    return dirs
+
+def is_source_file(path):
+    return path.endswith('.py')
+
+class PollingWatcher(object):
+    """
+    Checks the loaded modules in the watched directories, and files which
+    failed to import, for a new modification time.
+    """
+
+    def __init__(self, dirs, interval=1):
+        self.root = os.getcwd()
+        self.dirs = [path + os.sep for path in dirs]
+        self.interval = interval
+        self.mtimes = {}
+
+    def is_watched(self, path):
+        if os.path.dirname(path) == self.root:
+            return True
+        for path_prefix in self.dirs:
+            if path.startswith(path_prefix):
+                return True
+        return False
+
+    def files(self):
+        for module in sys.modules.values():
+            filename = getattr(module, '__file__', None)
+            if not filename:
+                continue
+            if filename.endswith('.pyc') or filename.endswith('.pyo'):
+                filename = filename[:-1]
+            filename = os.path.abspath(filename)
+            if self.is_watched(filename):
+                yield filename
+        for filename in _error_files:
+            yield filename
+
+    def changed(self):
+        "Returns the files which have changed since the last check"
+        changed = []
+        for filename in self.files():
+            try:
+                mtime = os.stat(filename).st_mtime
+            except OSError:
+                continue
+            if filename in self.mtimes and mtime != self.mtimes[filename]:
+                changed.append(filename)
+            self.mtimes[filename] = mtime
+        return changed
+
+    def wait(self, timeout):
+        "Waits up to timeout seconds for changes, returning the changed files"
+        end = time.time() + timeout
+        while True:
+            changed = self.changed()
+            if changed or time.time() >= end:
+                return changed
+            time.sleep(self.interval)
+
+class InotifyWatcher(object):
+    "Waits for inotify events on the source files in the watched directories"
+
+    def __init__(self, dirs, debounce=0.1):
+        import pyinotify
+        self.debounce = debounce
+        self.changes = []
+
+        watcher = self
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                if is_source_file(event.pathname):
+                    watcher.changes.append(event.pathname)
+
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | \
+            pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE | pyinotify.IN_CREATE
+        self.watch_manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.watch_manager, Handler())
+        self.watch_manager.add_watch(os.getcwd(), mask)
+        for path in dirs:
+            self.watch_manager.add_watch(path, mask, rec=True, auto_add=True,
+                exclude_filter=lambda path: os.path.basename(path).startswith('.'))
+        for filename in _error_files:
+            self.watch_manager.add_watch(os.path.dirname(filename), mask)
+
+    def _read(self, timeout):
+        if self.notifier.check_events(int(timeout * 1000)):
+            self.notifier.read_events()
+            self.notifier.process_events()
+            return True
+        return False
+
+    def wait(self, timeout):
+        "Waits up to timeout seconds for changes, returning the changed files"
+        self._read(timeout)
+        if not self.changes:
+            return []
+        # Let the rest of a save which touches several files arrive
+        while self._read(self.debounce):
+            pass
+        changed, self.changes = sorted(set(self.changes)), []
+        return changed
+
+def get_watcher():
+    dirs = get_watch_dirs()
+    try:
+        return InotifyWatcher(dirs,
+            getattr(settings, 'RUNTESTER_DEBOUNCE', 0.1))
+    except ImportError:
+        return PollingWatcher(dirs)
@@ -0,0 +1,22 @@
+"""
+Tests for test_extensions itself. Run them from the top of the checkout:
+
+    python -m unittest discover -s tests -t .
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'src'))
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:'},
+            'other': {'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:'}},
+        INSTALLED_APPS=[],
+    )
@@ -0,0 +1,68 @@
+import os
+import unittest
+
+from django.conf import settings
+
+from test_extensions.testrunners.codecoverage import ModuleMatcher, \
+    is_wanted_module
+
+class ModuleMatcherTest(unittest.TestCase):
+
+    def test_names_and_prefixes(self):
+        matcher = ModuleMatcher(excluded=['myproject.settings', 'myproject.legacy.*'])
+        self.assertFalse(matcher.is_wanted('myproject.settings'))
+        self.assertFalse(matcher.is_wanted('myproject.legacy.views'))
+        self.assertFalse(matcher.is_wanted('myproject.legacy.views.admin'))
+        self.assertTrue(matcher.is_wanted('myproject.legacy'))
+        self.assertTrue(matcher.is_wanted('myproject.legacyviews'))
+        self.assertTrue(matcher.is_wanted('myproject.settings.local'))
+
+    def test_globs(self):
+        matcher = ModuleMatcher(excluded=['myproject.*.admin', 'myproject.app?.tests'])
+        self.assertFalse(matcher.is_wanted('myproject.blog.admin'))
+        self.assertFalse(matcher.is_wanted('myproject.app1.tests'))
+        self.assertTrue(matcher.is_wanted('myproject.app10.tests'))
+        self.assertTrue(matcher.is_wanted('myproject.blog.admin_site'))
+
+    def test_include_beats_exclude(self):
+        matcher = ModuleMatcher(included=['myproject.legacy.api'],
+            excluded=['myproject.legacy.*'])
+        self.assertTrue(matcher.is_wanted('myproject.legacy.api'))
+        self.assertFalse(matcher.is_wanted('myproject.legacy.views'))
+
+    def test_unmatched_only_wanted_without_includes(self):
+        self.assertTrue(ModuleMatcher(excluded=['other.*']).is_wanted('myproject.views'))
+        self.assertFalse(ModuleMatcher(included=['other.*']).is_wanted('myproject.views'))
+        self.assertTrue(ModuleMatcher().is_wanted('myproject.views'))
+
+    def test_paths(self):
+        matcher = ModuleMatcher(excluded=['myproject/legacy/*', '*/migrations/*.py',
+            'myproject/settings.py'])
+        self.assertFalse(matcher.is_wanted('legacy.views', 'myproject/legacy/views.py'))
+        self.assertFalse(matcher.is_wanted('blog.migrations.0001',
+            'myproject/blog/migrations/0001.py'))
+        self.assertFalse(matcher.is_wanted('settings', 'myproject/settings.py'))
+        self.assertFalse(matcher.is_wanted('settings',
+            os.path.abspath(os.path.join('myproject', 'settings.py'))))
+        self.assertTrue(matcher.is_wanted('blog.views', 'myproject/blog/views.py'))
+        # Path rules only apply when the file is known
+        self.assertTrue(matcher.is_wanted('legacy.views'))
+
+class IsWantedModuleTest(unittest.TestCase):
+
+    def tearDown(self):
+        for name in ('COVERAGE_INCLUDE_MODULES', 'COVERAGE_EXCLUDE_MODULES'):
+            if hasattr(settings, name):
+                delattr(settings, name)
+
+    def test_follows_the_settings(self):
+        settings.COVERAGE_EXCLUDE_MODULES = ['myproject.legacy.*']
+        self.assertFalse(is_wanted_module('myproject.legacy.views'))
+        settings.COVERAGE_EXCLUDE_MODULES = []
+        self.assertTrue(is_wanted_module('myproject.legacy.views'))
+
+    def test_module_file(self):
+        settings.COVERAGE_EXCLUDE_MODULES = ['*/testrunners/*']
+        self.assertTrue(is_wanted_module(os))
+        import test_extensions.testrunners.codecoverage as codecoverage
+        self.assertFalse(is_wanted_module(codecoverage))
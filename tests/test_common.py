@@ -0,0 +1,131 @@
+import re
+import unittest
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connections, models
+from django.utils.datastructures import SortedDict
+
+from test_extensions.common import LRUCache, PatternCache, count_objects
+
+class LRUCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+        self.cache = LRUCache(3)
+
+    def create(self, key):
+        self.created.append(key)
+        return key.upper()
+
+    def lookup(self, *keys):
+        return [self.cache.lookup(key, self.create, key) for key in keys]
+
+    def test_lookup(self):
+        self.assertEqual(['A', 'B', 'A'], self.lookup('a', 'b', 'a'))
+        self.assertEqual(['a', 'b'], self.created)
+
+    def test_evicts_least_recently_used(self):
+        self.lookup('a', 'b', 'c', 'a', 'd')
+        # b was used least recently, a having been looked up again
+        self.assertEqual(['c', 'a', 'd'], list(self.cache.entries))
+        self.lookup('b')
+        self.assertEqual(['a', 'd', 'b'], list(self.cache.entries))
+        self.assertEqual(['a', 'b', 'c', 'd', 'b'], self.created)
+
+    def test_evicts_without_ordered_dict(self):
+        # As on Python < 2.7
+        self.cache.entries = SortedDict()
+        self.test_evicts_least_recently_used()
+
+    def test_stats(self):
+        self.lookup('a', 'b', 'a', 'c', 'd', 'a')
+        self.assertEqual({'hits': 2, 'misses': 4, 'size': 3, 'maxsize': 3},
+            self.cache.stats())
+        self.cache.clear()
+        self.assertEqual({'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 3},
+            self.cache.stats())
+
+class PatternCacheTest(unittest.TestCase):
+
+    def test_stats(self):
+        cache = PatternCache(10)
+        pattern = cache.compile('a+')
+        self.assertTrue(pattern is cache.compile('a+'))
+        self.assertEqual(re.I, cache.compile('a+', re.I).flags & re.I)
+        cache.compile(u'a+')
+        self.assertEqual({'hits': 1, 'misses': 3, 'size': 3, 'maxsize': 10},
+            cache.stats())
+
+class Item(models.Model):
+    name = models.CharField(max_length=10)
+    parent = models.ForeignKey('self', null=True)
+
+    class Meta:
+        app_label = 'tests'
+        ordering = ('name',)
+
+class CountObjectsTest(unittest.TestCase):
+    "Items a to e in the default database, and x and y in the other one"
+
+    def setUp(self):
+        for db in ('default', 'other'):
+            cursor = connections[db].cursor()
+            for sql in connections[db].creation.sql_create_model(Item, no_style(),
+                    set())[0]:
+                cursor.execute(sql)
+        for name in 'abcde':
+            Item.objects.create(name=name)
+        for name in 'xy':
+            Item.objects.using('other').create(name=name)
+        self.debug = settings.DEBUG
+        settings.DEBUG = True
+        for db in ('default', 'other'):
+            connections[db].queries = []
+
+    def tearDown(self):
+        settings.DEBUG = self.debug
+        for db in ('default', 'other'):
+            connections[db].cursor().execute('DROP TABLE tests_item')
+
+    def statements(self, db='default'):
+        return len(connections[db].queries)
+
+    def test_one_statement(self):
+        self.assertEqual([5, 2, 1, 0], count_objects([Item,
+            Item.objects.filter(name__in=['a', 'b']), Item.objects.filter(name='c'),
+            Item.objects.filter(name='z')]))
+        self.assertEqual(1, self.statements())
+
+    def test_managers_and_querysets(self):
+        self.assertEqual([5, 5, 4], count_objects([Item.objects, Item.objects.all(),
+            Item.objects.exclude(name='a').select_related('parent')]))
+        self.assertEqual(1, self.statements())
+
+    def test_batches(self):
+        querysets = [Item.objects.filter(name='abcde'[i % 5]) for i in range(120)]
+        self.assertEqual([1] * 120, count_objects(querysets))
+        self.assertEqual(3, self.statements())
+
+    def test_empty(self):
+        self.assertEqual([0, 0, 5], count_objects([Item.objects.none(),
+            Item.objects.filter(name__in=[]), Item]))
+        self.assertEqual(1, self.statements())
+
+    def test_only_empty(self):
+        self.assertEqual([0, 0], count_objects([Item.objects.none(),
+            Item.objects.filter(pk__in=[])]))
+        self.assertEqual(0, self.statements())
+
+    def test_slices(self):
+        self.assertEqual([2, 3, 1, 0], count_objects([Item.objects.all()[:2],
+            Item.objects.all()[2:], Item.objects.order_by('-name')[1:2],
+            Item.objects.all()[10:]]))
+        self.assertEqual(1, self.statements())
+
+    def test_databases(self):
+        self.assertEqual([5, 2, 1, 1], count_objects([Item,
+            Item.objects.using('other'), Item.objects.filter(name='a'),
+            Item.objects.using('other').filter(name='y')]))
+        self.assertEqual(1, self.statements())
+        self.assertEqual(1, self.statements('other'))
@@ -0,0 +1,131 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from django.conf import settings
+
+from test_extensions.testrunners.discovery import DiscoveryIndex, imported_names
+
+TESTS = '''import unittest
+from discoveryapp.helpers import VALUE
+
+class HelperTest(unittest.TestCase):
+    def test_value(self):
+        self.assertEqual(1, VALUE)
+'''
+
+class DiscoveryIndexTest(unittest.TestCase):
+    """
+    A project with one app, whose tests import a helper module, and an
+    unrelated module.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.old_cwd = os.getcwd()
+        self.old_apps = settings.INSTALLED_APPS
+        os.chdir(self.directory)
+        sys.path.insert(0, self.directory)
+        settings.INSTALLED_APPS = ['discoveryapp']
+        os.mkdir('discoveryapp')
+        self.write('discoveryapp/__init__.py', '')
+        self.write('discoveryapp/models.py', '')
+        self.write('discoveryapp/helpers.py', 'VALUE = 1\n')
+        self.write('discoveryapp/tests.py', TESTS)
+        self.write('other.py', 'VALUE = 2\n')
+        self.index_file = os.path.join(self.directory, 'index.json')
+        self.built = DiscoveryIndex(self.index_file)
+        self.built.lookup('discoveryapp')
+        self.built.save()
+        self.unload()
+
+    def tearDown(self):
+        self.unload()
+        settings.INSTALLED_APPS = self.old_apps
+        sys.path.remove(self.directory)
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.directory)
+
+    def write(self, file_name, source, mtime=1000):
+        source_file = open(file_name, 'w')
+        try:
+            source_file.write(source)
+        finally:
+            source_file.close()
+        os.utime(file_name, (mtime, mtime))
+        for compiled in (file_name + 'c', file_name + 'o'):
+            if os.path.exists(compiled):
+                os.remove(compiled)
+
+    def unload(self):
+        for name in list(sys.modules):
+            if name == 'discoveryapp' or name.startswith('discoveryapp.'):
+                del sys.modules[name]
+
+    def test_entry_files(self):
+        files = self.built.apps['discoveryapp']['files']
+        self.assertTrue(os.path.abspath('discoveryapp/helpers.py') in files)
+        self.assertTrue(os.path.abspath('discoveryapp/tests.py') in files)
+        self.assertFalse(os.path.abspath('other.py') in files)
+
+    def test_fresh_entry(self):
+        index = DiscoveryIndex(self.index_file)
+        self.assertEqual([('discoveryapp.HelperTest.test_value',
+            ['discoveryapp.tests.HelperTest.test_value'])],
+            index.lookup('discoveryapp'))
+        self.assertFalse(index.changed)
+        # Only the app's package was needed
+        self.assertFalse('discoveryapp.models' in sys.modules)
+        self.assertFalse('discoveryapp.tests' in sys.modules)
+
+    def test_unrelated_change(self):
+        self.write('other.py', 'VALUE = 3\n', 2000)
+        index = DiscoveryIndex(self.index_file)
+        index.lookup('discoveryapp')
+        self.assertFalse(index.changed)
+
+    def test_stale_tests_module(self):
+        self.write('discoveryapp/tests.py', TESTS +
+            '    def test_more(self):\n        pass\n', 2000)
+        index = DiscoveryIndex(self.index_file)
+        self.assertEqual(['discoveryapp.HelperTest.test_more',
+            'discoveryapp.HelperTest.test_value'],
+            sorted([label for label, test_ids in index.lookup('discoveryapp')]))
+        self.assertTrue(index.changed)
+
+    def test_stale_imported_module(self):
+        self.write('discoveryapp/helpers.py', 'VALUE = 4\n', 2000)
+        index = DiscoveryIndex(self.index_file)
+        index.lookup('discoveryapp')
+        self.assertTrue(index.changed)
+
+    def test_build_test(self):
+        index = DiscoveryIndex(self.index_file)
+        suite = index.build_test('discoveryapp.HelperTest.test_value')
+        self.assertEqual(['discoveryapp.tests.HelperTest.test_value'],
+            [test.id() for test in suite])
+        self.assertFalse('discoveryapp.models' in sys.modules)
+
+class ImportedNamesTest(unittest.TestCase):
+
+    def test_absolute_imports(self):
+        names = imported_names('import os.path\nfrom blog.models import Post\n', '')
+        self.assertEqual(set(['os.path', 'blog.models', 'blog.models.Post']), names)
+
+    def test_implicit_relative_imports(self):
+        names = imported_names('import constants\nfrom models import Post\n', 'blog')
+        self.assertTrue('blog.constants' in names)
+        self.assertTrue('blog.models' in names)
+        self.assertTrue('constants' in names)
+
+    def test_explicit_relative_imports(self):
+        names = imported_names('from . import constants\nfrom ..shop import models\n',
+            'project.blog')
+        self.assertTrue('project.blog.constants' in names)
+        self.assertTrue('project.shop.models' in names)
+
+    def test_imports_inside_functions(self):
+        names = imported_names('def f():\n    import json\n', '')
+        self.assertEqual(set(['json']), names)
@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from test_extensions.testrunners.impact import diff_file, fingerprint, \
+    find_changes, is_affected
+
+def write(file_name, source, mtime):
+    source_file = open(file_name, 'w')
+    try:
+        source_file.write(source)
+    finally:
+        source_file.close()
+    os.utime(file_name, (mtime, mtime))
+
+class DiffFileTest(unittest.TestCase):
+
+    def test_changed_and_moved_lines(self):
+        old = (0, '', [1, 2, 3, 4])
+        new = (0, '', [1, 5, 2, 3])
+        changed, moved = diff_file(old, new)
+        # The lines either side of an insertion and deleted lines have changed
+        self.assertEqual(set([1, 2, 4]), changed)
+        self.assertEqual({1: 1, 2: 3, 3: 4}, moved)
+
+    def test_replaced_line(self):
+        changed, moved = diff_file((0, '', [1, 2, 3]), (0, '', [1, 9, 3]))
+        self.assertEqual(set([2]), changed)
+        self.assertEqual({1: 1, 3: 3}, moved)
+
+class FindChangesTest(unittest.TestCase):
+    """
+    A project where the tests module imports constants.py at the top,
+    running LIMIT = 3 on import. test_limit uses LIMIT and test_double
+    calls double().
+    """
+
+    constants = 'LIMIT = 3\n\ndef double(x):\n    return x * 2\n\ndef unused():\n    return 0\n'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.constants_file = os.path.join(self.directory, 'constants.py')
+        self.tests_file = os.path.join(self.directory, 'tests.py')
+        self.settings_file = os.path.join(self.directory, 'settings.py')
+        write(self.constants_file, self.constants, 1000)
+        write(self.tests_file, 'from constants import *\n', 1000)
+        write(self.settings_file, 'DEBUG = True\n', 1000)
+        self.index = {
+            'files': {self.constants_file: fingerprint(self.constants_file),
+                self.tests_file: fingerprint(self.tests_file)},
+            'tests': {
+                'tests.Test.test_limit': (False,
+                    {self.tests_file: set([1]), self.constants_file: set()}),
+                'tests.Test.test_double': (False,
+                    {self.tests_file: set([1]), self.constants_file: set([4])}),
+                'other.Test.test_other': (False, {}),
+            },
+            'imports': {self.constants_file: set([1, 3, 6]),
+                self.tests_file: set([1])},
+            'source': [self.directory],
+            'time': 1500,
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def affected(self):
+        changes = find_changes(self.index)
+        return sorted([test_id for test_id, entry in self.index['tests'].items()
+            if is_affected(entry, changes)])
+
+    def test_nothing_changed(self):
+        self.assertEqual({}, find_changes(self.index))
+        self.assertEqual([], self.affected())
+
+    def test_touched_file(self):
+        os.utime(self.constants_file, (2000, 2000))
+        changes = find_changes(self.index)
+        self.assertEqual(set(), changes[self.constants_file][0])
+        self.assertEqual(None, changes[self.constants_file][1])
+        self.assertEqual([], self.affected())
+
+    def test_executed_line(self):
+        write(self.constants_file, self.constants.replace('x * 2', 'x + x'), 2000)
+        self.assertEqual(set([4]), find_changes(self.index)[self.constants_file][0])
+        self.assertEqual(['tests.Test.test_double'], self.affected())
+
+    def test_import_time_line(self):
+        write(self.constants_file, self.constants.replace('3', '4'), 2000)
+        self.assertEqual(None, find_changes(self.index)[self.constants_file][0])
+        self.assertEqual(['tests.Test.test_double', 'tests.Test.test_limit'],
+            self.affected())
+
+    def test_line_never_executed(self):
+        # The index may be missing the lines of modules imported before recording
+        self.index['imports'] = {}
+        write(self.constants_file, self.constants.replace('return 0', 'return 1'), 2000)
+        self.assertEqual(None, find_changes(self.index)[self.constants_file][0])
+        self.assertEqual(['tests.Test.test_double', 'tests.Test.test_limit'],
+            self.affected())
+
+    def test_removed_file(self):
+        os.remove(self.constants_file)
+        self.assertEqual(None, find_changes(self.index)[self.constants_file][0])
+        self.assertEqual(['tests.Test.test_double', 'tests.Test.test_limit'],
+            self.affected())
+
+    def test_unindexed_file(self):
+        write(self.settings_file, 'DEBUG = False\n', 2000)
+        self.assertTrue(None in find_changes(self.index))
+        self.assertEqual(['other.Test.test_other', 'tests.Test.test_double',
+            'tests.Test.test_limit'], self.affected())
+
+    def test_new_file(self):
+        write(os.path.join(self.directory, 'helpers.py'), '', 2000)
+        self.assertEqual(3, len(self.affected()))
+
+    def test_unindexed_file_changed_before_recording(self):
+        write(self.settings_file, 'DEBUG = False\n', 1200)
+        self.assertEqual([], self.affected())
+
+    def test_failed_and_new_tests(self):
+        changes = find_changes(self.index)
+        self.assertTrue(is_affected(None, changes))
+        self.assertTrue(is_affected((True, {}), changes))
@@ -0,0 +1,83 @@
+import unittest
+
+from test_extensions.testrunners.parallel import split_tests, worker_database_name
+
+class FakeTest(object):
+    def __init__(self, test_id):
+        self.test_id = test_id
+
+    def id(self):
+        return self.test_id
+
+    def __repr__(self):
+        return self.test_id
+
+def make_tests(*test_ids):
+    return [FakeTest(test_id) for test_id in test_ids]
+
+def ids(chunks):
+    return [[test.id() for test in chunk] for chunk in chunks]
+
+class SplitTestsTest(unittest.TestCase):
+
+    def assertSplit(self, tests, chunks):
+        "Every test is in exactly one chunk, keeping its order and its group"
+        seen = [test for chunk in chunks for test in chunk]
+        self.assertEqual(sorted(map(id, tests)), sorted(map(id, seen)))
+        groups = {}
+        for index, chunk in enumerate(chunks):
+            self.assertTrue(chunk)
+            self.assertEqual([test for test in tests if test in chunk], chunk)
+            for test in chunk:
+                group = test.id().rsplit('.', 1)[0]
+                self.assertEqual(index, groups.setdefault(group, index))
+
+    def test_without_timings_counts_tests(self):
+        tests = make_tests('app.A.test_1', 'app.A.test_2', 'app.B.test_1',
+            'app.C.test_1', 'app.D.test_1', 'app.D.test_2')
+        chunks = split_tests(tests, 2)
+        self.assertSplit(tests, chunks)
+        self.assertEqual([3, 3], sorted([len(chunk) for chunk in chunks]))
+
+    def test_without_timings_many_groups(self):
+        tests = make_tests(*['app.Test%d.test_%d' % (i % 7, i) for i in range(50)])
+        for processes in (1, 2, 3, 4, 8):
+            chunks = split_tests(tests, processes)
+            self.assertSplit(tests, chunks)
+            sizes = [len(chunk) for chunk in chunks]
+            # The largest group has 8 tests
+            self.assertTrue(max(sizes) - min(sizes) <= 8)
+
+    def test_balanced_by_timings(self):
+        tests = make_tests('app.A.test', 'app.B.test', 'app.C.test', 'app.D.test')
+        timings = {'app.A.test': 3.0, 'app.B.test': 1.0, 'app.C.test': 1.0,
+            'app.D.test': 1.0}
+        self.assertEqual([['app.A.test'], ['app.B.test', 'app.C.test', 'app.D.test']],
+            ids(split_tests(tests, 2, timings)))
+
+    def test_unknown_ids_count_as_the_average(self):
+        tests = make_tests('app.A.test', 'app.B.test', 'app.C.test')
+        timings = {'app.A.test': 4.0, 'app.B.test': 2.0, 'gone.Test.test': 3.0}
+        # C counts as 3 seconds, so goes with B rather than A
+        self.assertEqual([['app.A.test'], ['app.B.test', 'app.C.test']],
+            ids(split_tests(tests, 2, timings)))
+
+    def test_more_processes_than_tests(self):
+        tests = make_tests('app.A.test', 'app.B.test', 'app.C.test')
+        chunks = split_tests(tests, 5)
+        self.assertSplit(tests, chunks)
+        self.assertEqual(3, len(chunks))
+        timings = dict.fromkeys(['app.A.test', 'app.B.test', 'app.C.test'], 1.0)
+        chunks = split_tests(tests, 5, timings)
+        self.assertSplit(tests, chunks)
+        self.assertEqual(3, len(chunks))
+
+    def test_no_tests(self):
+        self.assertEqual([], split_tests([], 3))
+
+class WorkerDatabaseNameTest(unittest.TestCase):
+
+    def test_names(self):
+        self.assertEqual('test_db_2', worker_database_name('test_db', 2))
+        self.assertEqual(':memory:', worker_database_name(':memory:', 2))
+        self.assertEqual('', worker_database_name('', 2))
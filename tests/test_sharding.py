@@ -0,0 +1,70 @@
+import unittest
+
+from test_extensions.testrunners.sharding import parse_shard, select_shard, \
+    get_shard_labels
+
+def make_collected(count):
+    "Returns (label, test ids) pairs for count tests, some in groups"
+    collected = []
+    for index in range(count):
+        if index % 5 == 0:
+            collected.append(('app%d' % index,
+                ['app%d.tests.Test.test_%d' % (index, n) for n in range(3)]))
+        else:
+            collected.append(('app.Test.test_%d' % index,
+                ['app.tests.Test.test_%d' % index]))
+    return collected
+
+class SelectShardTest(unittest.TestCase):
+
+    def assertPartitions(self, collected, shards, timings=None):
+        labels = [label for label, test_ids in collected]
+        seen = []
+        for shard in range(1, shards + 1):
+            selected = select_shard(collected, shard, shards, timings)
+            # Each shard keeps the original order
+            self.assertEqual([label for label in labels if label in selected],
+                selected)
+            seen.extend(selected)
+        self.assertEqual(sorted(labels), sorted(seen))
+
+    def test_partitions_by_hash(self):
+        for count in (0, 1, 9, 100):
+            for shards in (1, 2, 3, 7, 20):
+                self.assertPartitions(make_collected(count), shards)
+
+    def test_partitions_by_timings(self):
+        collected = make_collected(100)
+        timings = {}
+        for index, (label, test_ids) in enumerate(collected):
+            # Some tests have no timing and count as the average
+            if index % 4:
+                for test_id in test_ids:
+                    timings[test_id] = (index * 7 % 13) / 10.0
+        for shards in (1, 2, 3, 7, 20, 150):
+            self.assertPartitions(collected, shards, timings)
+
+    def test_balanced_by_timings(self):
+        collected = [('a', ['a']), ('b', ['b']), ('c', ['c']), ('d', ['d'])]
+        timings = {'a': 3.0, 'b': 1.0, 'c': 1.0, 'd': 1.0}
+        self.assertEqual(['a'], select_shard(collected, 1, 2, timings))
+        self.assertEqual(['b', 'c', 'd'], select_shard(collected, 2, 2, timings))
+
+    def test_same_split_every_time(self):
+        collected = make_collected(50)
+        self.assertEqual(select_shard(collected, 2, 3),
+            select_shard(list(collected), 2, 3))
+
+class GetShardLabelsTest(unittest.TestCase):
+
+    def test_missing_timings_file(self):
+        self.assertRaises(ValueError, get_shard_labels, ['app'], 1, 2,
+            '/nonexistent/test_timings.json')
+
+class ParseShardTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual((2, 4), parse_shard('2/4'))
+        self.assertRaises(ValueError, parse_shard, '5/4')
+        self.assertRaises(ValueError, parse_shard, '0/4')
+        self.assertRaises(ValueError, parse_shard, 'two')
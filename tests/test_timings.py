@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from django.test import TestCase
+
+from test_extensions.testrunners import timings
+from test_extensions.testrunners.timings import save_timings, load_timings, \
+    load_failures, order_failed_first, slowest_tests
+from test_extensions.testrunners.pipeline import TimedTextTestRunner
+
+class Examples(object):
+    "Tests for the runners here to run, kept out of sight of the loader"
+
+    class Plain(unittest.TestCase):
+        def test_a(self):
+            pass
+        def test_b(self):
+            self.fail()
+        def test_c(self):
+            raise ValueError
+        def test_d(self):
+            pass
+
+    class Database(TestCase):
+        def test_e(self):
+            pass
+
+def plain(*names):
+    return [Examples.Plain(name) for name in names]
+
+class OrderFailedFirstTest(unittest.TestCase):
+
+    def test_failures_first(self):
+        tests = plain('test_a', 'test_b', 'test_c', 'test_d')
+        ordered = order_failed_first(tests,
+            set([test.id() for test in plain('test_c', 'test_d')]))
+        self.assertEqual(['test_c', 'test_d', 'test_a', 'test_b'],
+            [test._testMethodName for test in ordered])
+
+    def test_database_tests_stay_first(self):
+        tests = plain('test_a') + [Examples.Database('test_e')] + plain('test_b')
+        ordered = order_failed_first(tests, set([plain('test_b')[0].id()]))
+        self.assertEqual(['test_e', 'test_b', 'test_a'],
+            [test._testMethodName for test in ordered])
+
+class TimingFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'timings', 'test_timings.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_merges(self):
+        save_timings({'a': (1.23456, False), 'b': (0.5, True)}, self.file_name)
+        save_timings({'b': (0.25, False), 'c': (2.0, True)}, self.file_name)
+        self.assertEqual({'a': 1.235, 'b': 0.25, 'c': 2.0}, load_timings(self.file_name))
+        self.assertEqual(set(['c']), load_failures(self.file_name))
+
+    def test_save_is_atomic(self):
+        save_timings({'a': (1.0, False)}, self.file_name)
+        original = open(self.file_name).read()
+
+        def broken_dump(store, timing_file, **kwargs):
+            timing_file.write('{"a": [')
+            raise IOError('disk full')
+        dump = timings.json.dump
+        timings.json.dump = broken_dump
+        try:
+            self.assertRaises(IOError, save_timings, {'b': (2.0, False)}, self.file_name)
+        finally:
+            timings.json.dump = dump
+        self.assertEqual(original, open(self.file_name).read())
+        self.assertEqual(['test_timings.json'],
+            os.listdir(os.path.dirname(self.file_name)))
+
+    def test_missing_file(self):
+        self.assertEqual({}, load_timings(self.file_name))
+        self.assertEqual([], slowest_tests(3, self.file_name))
+
+    def test_slowest_tests(self):
+        save_timings({'a': (1.0, False), 'b': (3.0, False), 'c': (2.0, True),
+            'd': (0.5, False)}, self.file_name)
+        self.assertEqual([(3.0, 'b'), (2.0, 'c')], slowest_tests(2, self.file_name))
+        self.assertEqual(4, len(slowest_tests(10, self.file_name)))
+
+class TimedTextTestRunnerTest(unittest.TestCase):
+
+    def test_records_timings_and_failures(self):
+        suite = unittest.TestSuite(plain('test_a', 'test_b', 'test_c'))
+        runner = TimedTextTestRunner(stream=open(os.devnull, 'w'))
+        result = runner.run(suite)
+        self.assertEqual(dict([(plain(name)[0].id(), failed) for name, failed in
+            (('test_a', False), ('test_b', True), ('test_c', True))]),
+            dict([(test_id, failed) for test_id, (seconds, failed)
+                in result.timings.items()]))
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+from xml.dom import minidom
+
+from test_extensions.testrunners.xmlmerge import merge_totals, merge_reports
+
+# As the xml runner writes them, with the testsuite start tag padded out
+# to the space left for it
+FIRST = ('<testsuite %s>' % 'errors="1" failures="0" name="" tests="2" time="1.500" '.ljust(245) +
+    '<testcase classname="app.tests.A" name="test_a" time="0.500"/>'
+    '<testcase classname="app.tests.A" name="test_b" time="1.000">'
+    '<error type="ValueError"><![CDATA[Traceback: a < b > c]]></error>'
+    '<system-out><![CDATA[printed ]]]]><![CDATA[> <here>]]></system-out>'
+    '</testcase>'
+    '<system-out><![CDATA[before the tests]]></system-out>'
+    '<system-err><![CDATA[]]></system-err>'
+    '</testsuite>')
+
+SECOND = ('<testsuite errors="0" failures="1" name="" skipped="1" tests="3" time="2.250">'
+    '<testcase classname="app.tests.B" name="test_c" time="2.250">'
+    '<failure type="AssertionError">1 != 2</failure>'
+    '</testcase>'
+    '<testcase classname="app.tests.B" name="test_d" time="0.000"></testcase>'
+    '<testcase classname="app.tests.B" name="test_e" time="0.000"><skipped/></testcase>'
+    '<system-out/>'
+    '<system-err><![CDATA[warning]]></system-err>'
+    '</testsuite>')
+
+class MergeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def report(self, name, content):
+        file_name = os.path.join(self.directory, name)
+        report = open(file_name, 'wb')
+        try:
+            report.write(content)
+        finally:
+            report.close()
+        return file_name
+
+    def merge(self, *contents):
+        file_names = [self.report('report_%d.xml' % i, content)
+            for i, content in enumerate(contents)]
+        output_file = os.path.join(self.directory, 'merged', 'report.xml')
+        merge_reports(file_names, output_file, 'merged')
+        return minidom.parse(output_file).documentElement
+
+    def text(self, element):
+        return ''.join([node.data for node in element.childNodes])
+
+    def test_merge_totals(self):
+        totals = merge_totals([self.report('first.xml', FIRST),
+            self.report('second.xml', SECOND)])
+        self.assertEqual({'errors': 1, 'failures': 1, 'skipped': 1, 'tests': 5,
+            'time': 3.75}, totals)
+
+    def test_merge_totals_without_skipped(self):
+        totals = merge_totals([self.report('first.xml', FIRST)])
+        self.assertFalse('skipped' in totals)
+
+    def test_merge_reports(self):
+        suite = self.merge(FIRST, SECOND)
+        self.assertEqual('merged', suite.getAttribute('name'))
+        self.assertEqual(['1', '1', '1', '5', '3.750'], [suite.getAttribute(name)
+            for name in ('errors', 'failures', 'skipped', 'tests', 'time')])
+        cases = suite.getElementsByTagName('testcase')
+        self.assertEqual(['test_a', 'test_b', 'test_c', 'test_d', 'test_e'],
+            [case.getAttribute('name') for case in cases])
+        self.assertEqual('Traceback: a < b > c',
+            self.text(cases[1].getElementsByTagName('error')[0]))
+        self.assertEqual('printed ]]> <here>',
+            self.text(cases[1].getElementsByTagName('system-out')[0]))
+        self.assertEqual(1, len(cases[4].getElementsByTagName('skipped')))
+
+    def test_suite_output(self):
+        suite = self.merge(FIRST, SECOND)
+        children = [node for node in suite.childNodes if node.nodeName != 'testcase']
+        self.assertEqual(['system-out', 'system-err'],
+            [node.nodeName for node in children])
+        self.assertEqual('before the tests', self.text(children[0]))
+        self.assertEqual('warning', self.text(children[1]))
+
+    def test_large_report(self):
+        # Test cases span the chunks the reports are read in
+        case = ('<testcase classname="app.tests.C" name="test_%d" time="0.001">'
+            '<system-out><![CDATA[' + 'x' * 1000 + ']]></system-out></testcase>')
+        content = '<testsuite errors="0" failures="0" name="" tests="200" time="0.200">' + \
+            ''.join([case % i for i in range(200)]) + '</testsuite>'
+        suite = self.merge(content, SECOND)
+        cases = suite.getElementsByTagName('testcase')
+        self.assertEqual(203, len(cases))
+        self.assertEqual(['test_%d' % i for i in range(200)],
+            [case.getAttribute('name') for case in cases[:200]])
+        self.assertEqual('x' * 1000,
+            self.text(cases[199].getElementsByTagName('system-out')[0]))
+        self.assertEqual('203', suite.getAttribute('tests'))
@@ -0,0 +1,77 @@
+import unittest
+from StringIO import StringIO
+from xml.dom import minidom
+
+from test_extensions.testrunners.xmlunit.unittest import XmlTextTestRunner, _cdata
+
+StdOut = XmlTextTestRunner._StdOut
+
+class StdOutTest(unittest.TestCase):
+
+    def test_passes_output_through(self):
+        std = StringIO()
+        out = StdOut(std, 10)
+        out.write('x' * 25)
+        self.assertEqual('x' * 25, std.getvalue())
+
+    def test_under_limit(self):
+        out = StdOut(None, 10)
+        out.write('abc')
+        out.write('defg')
+        self.assertEqual('abcdefg', out.read())
+
+    def test_keeps_newest_output(self):
+        out = StdOut(None, 10)
+        out.write('x' * 6)
+        out.write('y' * 6)
+        self.assertEqual('[... 2 bytes truncated ...]\nxxxxyyyyyy', out.read())
+        out.write('z' * 25)
+        self.assertEqual('[... 27 bytes truncated ...]\n' + 'z' * 10, out.read())
+
+    def test_multibyte_characters_kept_whole(self):
+        out = StdOut(None, 5)
+        out.write(u'\xe9\xe9\xe9')
+        self.assertEqual('[... 2 bytes truncated ...]\n' + u'\xe9\xe9'.encode('utf-8'),
+            out.read())
+
+    def test_write_element(self):
+        out = StdOut(None, 10)
+        output = StringIO()
+        out.write('a]]>b')
+        out.writeElement(output, 'system-out')
+        self.assertEqual('<system-out><![CDATA[a]]]]><![CDATA[>b]]></system-out>',
+            output.getvalue())
+        self.assertEqual('', out.read())
+
+    def test_set_aside(self):
+        out = StdOut(None, 10)
+        out.write('between')
+        out.setAside()
+        out.write('in test')
+        output = StringIO()
+        out.writeElement(output, 'system-out')
+        self.assertTrue('in test' in output.getvalue())
+        self.assertFalse('between' in output.getvalue())
+        out.write(' after')
+        self.assertEqual('[... 3 bytes truncated ...]\nween after', out.readOutside())
+        self.assertEqual('', out.read())
+
+    def test_nothing_set_aside(self):
+        out = StdOut(None, 10)
+        out.setAside()
+        self.assertEqual(None, out.outside)
+        self.assertEqual('', out.readOutside())
+
+class CDataTest(unittest.TestCase):
+
+    def parse(self, text):
+        element = minidom.parseString('<a><![CDATA[%s]]></a>' % _cdata(text))
+        return ''.join([node.data for node in element.documentElement.childNodes])
+
+    def test_end_marker(self):
+        self.assertEqual('a]]]]><![CDATA[>b', _cdata('a]]>b'))
+        self.assertEqual('a]]>b]]>', self.parse('a]]>b]]>'))
+
+    def test_control_characters(self):
+        self.assertEqual('a\\x00b\\x1bc\td\n', _cdata('a\x00b\x1bc\td\n'))
+        self.assertEqual('a\\x00b\n', self.parse('a\x00b\n'))